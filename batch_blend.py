@@ -0,0 +1,135 @@
+from __future__ import print_function
+import argparse
+import csv
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import from_openCV as fOCV
+from pyramid import Pyramid, PRECISIONS
+
+"""
+This module blends many pairs of images in parallel. The jobs are read from a
+manifest and distributed over a pool of processes. It is executed with
+`python batch_blend.py manifest.csv --workers 8`
+
+Every line of the manifest is a job with the comma-separated fields
+    left,right,output,levels,mask
+where levels and mask may be left empty. Empty lines and lines starting with
+'#' are ignored
+"""
+
+
+def readManifest(name,levels=4):
+    """
+    Function that reads the list of jobs from a manifest file
+    name: name of file containing the manifest
+    levels: number of levels used when a job leaves that field empty
+    returns: list of dictionaries, one per job
+    """
+    jobs = []
+    with open(name) as f:
+        for lineno,row in enumerate(csv.reader(f),1):
+            # Skip empty lines and comments
+            if not row or not row[0].strip() or row[0].strip().startswith('#'):
+                continue
+            row = [x.strip() for x in row] + ['']*(5-len(row))
+            if not (row[0] and row[1] and row[2]):
+                raise ValueError("%s:%d: left, right and output are required" % (name,lineno))
+            jobs.append({'left': row[0], 'right': row[1], 'output': row[2],
+                         'levels': int(row[3]) if row[3] else levels,
+                         'mask': row[4] or None, 'line': lineno})
+    return jobs
+
+
+def blendJob(job,method='opencv',a_=0.4,precision='legacy'):
+    """
+    Function that performs the blending of one job and writes it to file
+    job: dictionary as returned by readManifest
+    method: 'opencv' for from_openCV.blendImages, 'scratch' for the from-scratch pyramids
+    a_: parameter that determines kernel of the from-scratch path
+    precision: data types of the pyramid levels, see pyramid.PRECISIONS
+    """
+    if method == 'opencv':
+        fOCV.blendImages(job['left'],job['right'],job['output'],job['levels'],precision,job['mask'])
+        return
+    pyrA = Pyramid.fromFile(job['left'],a_,method,precision)
+    pyrB = Pyramid.fromFile(job['right'],a_,method,precision)
+    if job['mask'] is None:
+        blend = fOCV.blendPyramids(pyrA,pyrB,job['levels'])
+    else:
+        pyrM = Pyramid(fOCV.readMask(job['mask'],pyrA.gauss(0).shape),a_,method)
+        blend = fOCV.blendPyramidsMask(pyrA,pyrB,pyrM,job['levels'])
+    if not cv2.imwrite(job['output'],fOCV.toImage(blend)):
+        raise IOError("could not write image %r" % (job['output'],))
+
+
+def runJob(job,method='opencv',a_=0.4,precision='legacy'):
+    """
+    Function executed by the workers: blends one job and reports how it went
+    job: dictionary as returned by readManifest
+    method, a_, precision: see blendJob
+    returns: dictionary with the job, the elapsed time in seconds and the error (None if successful)
+    """
+    # Every process already works on its own job, so OpenCV's internal threads
+    # would only compete with the other workers for the cores
+    cv2.setNumThreads(1)
+    start_ = time.time()
+    error_ = None
+    try:
+        blendJob(job,method,a_,precision)
+    except Exception:
+        error_ = traceback.format_exc().strip().splitlines()[-1]
+    return {'job': job, 'seconds': time.time() - start_, 'error': error_}
+
+
+def runBatch(jobs,workers=None,method='opencv',a_=0.4,precision='legacy',report=None):
+    """
+    Function that distributes the jobs over a pool of processes
+    jobs: list of jobs as returned by readManifest
+    workers: number of processes; None uses as many as cores
+    method, a_, precision: see blendJob
+    report: optional function called with the result of each job as soon as it finishes
+    returns: list with the result of every job, in the order of the manifest
+    """
+    results = [None]*len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures_ = dict((pool.submit(runJob,job,method,a_,precision),i) for i,job in enumerate(jobs))
+        for future_ in as_completed(futures_):
+            results[futures_[future_]] = future_.result()
+            if report is not None:
+                report(results[futures_[future_]])
+    return results
+
+
+def printResult(result):
+    """
+    Function that shows on screen the outcome of a job
+    result: dictionary as returned by runJob
+    """
+    job = result['job']
+    status_ = 'ok' if result['error'] is None else 'FAILED: ' + result['error']
+    print('%-40s %8.3f s  %s' % (job['output'],result['seconds'],status_))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Blend many pairs of images in parallel')
+    parser.add_argument('manifest',help='file with one left,right,output,levels,mask job per line')
+    parser.add_argument('--workers',type=int,default=None,help='number of processes (default: number of cores)')
+    parser.add_argument('--method',choices=('opencv','scratch'),default='opencv')
+    parser.add_argument('--levels',type=int,default=4,help='levels of jobs that do not specify them')
+    parser.add_argument('--a',dest='a_',type=float,default=0.4,help='kernel parameter of the from-scratch path')
+    parser.add_argument('--precision',choices=sorted(PRECISIONS),default='legacy',help='data types of the pyramid levels')
+    args = parser.parse_args(argv)
+
+    jobs = readManifest(args.manifest,args.levels)
+    start_ = time.time()
+    results = runBatch(jobs,args.workers,args.method,args.a_,args.precision,report=printResult)
+    failed_ = [r for r in results if r['error'] is not None]
+    print('%d jobs, %d failed, %.3f s' % (len(results),len(failed_),time.time() - start_))
+    return 1 if failed_ else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,332 @@
+from __future__ import print_function
+import argparse
+import json
+import sys
+import timeit
+import cv2
+import numpy as np
+import gauss_pyramid as gp
+import laplace_pyramid as lp
+import from_openCV as fOCV
+from pyramid import Pyramid, PRECISIONS
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+"""
+This module benchmarks the three implementations of the pyramid operations:
+OpenCV ('opencv'), the per-pixel loops of gauss_pyramid/laplace_pyramid ('loop')
+and the vectorized from-scratch functions ('scratch'). For every operation,
+image size, depth and precision it reports wall time, peak memory and the
+deviation from the same operation done by cv2.pyrDown/cv2.pyrUp in float64.
+It is executed with `python benchmarks.py`; see `python benchmarks.py --help`
+"""
+
+
+def timeCall(func,args,repeat):
+    """
+    Function that measures the best wall time of a call
+    func: function to be timed
+    args: tuple of arguments passed to func
+    repeat: number of times the call is repeated; the minimum is kept
+    returns: best time in seconds
+    """
+    return min(timeit.repeat(lambda: func(*args),number=1,repeat=repeat))
+
+
+def randomImage(rows,cols,seed=0):
+    """
+    Function that generates a random BGR image to benchmark with
+    rows, cols: dimensions of the image
+    seed: seed of random generator so runs are reproducible
+    returns: uint8 matrix of shape (rows,cols,3)
+    """
+    # Pixels are kept away from zero: testConvIndx fails when all the samples
+    # under the kernel are zero
+    return np.random.RandomState(seed).randint(1,256,(rows,cols,3)).astype(np.uint8)
+
+
+def benchPair(loop_,fast_,sizes,a_=0.4,repeat=3,max_loop_size=256):
+    """
+    Function that compares a loop-based function with its vectorized version for several image sizes
+    loop_, fast_: functions with signature f(A,a_) to be compared
+    sizes: list of side lengths of the (square) images
+    a_: parameter that determines kernel
+    repeat: number of repetitions of each measurement
+    max_loop_size: images larger than this are not timed with the loop version
+    returns: list of dictionaries with the results for each size
+    """
+    results = []
+    for n in sizes:
+        A = randomImage(n,n)
+        row = {'size': n, 'fast': timeCall(fast_,(A,a_),repeat), 'loop': None, 'speedup': None, 'max_err': None}
+        # The loop version takes minutes on large images, so only run it
+        # where it finishes in reasonable time
+        if n <= max_loop_size:
+            row['loop'] = timeCall(loop_,(A,a_),1)
+            row['speedup'] = row['loop']/row['fast']
+            row['max_err'] = np.abs(loop_(A,a_) - fast_(A,a_)).max()
+        results.append(row)
+    return results
+
+
+def benchReduce(sizes,a_=0.4,repeat=3,max_loop_size=256):
+    """
+    Function that compares GaussPyr3D with fastGaussPyr3D; see benchPair
+    """
+    return benchPair(gp.GaussPyr3D,gp.fastGaussPyr3D,sizes,a_,repeat,max_loop_size)
+
+
+def benchExpand(sizes,a_=0.4,repeat=3,max_loop_size=64):
+    """
+    Function that compares LaplPyr3D with fastLaplPyr3D; see benchPair.
+    Sizes should be 2^N or 2^N + 1, since the expanded size is guessed with utilities.incrDim
+    """
+    return benchPair(lp.LaplPyr3D,lp.fastLaplPyr3D,sizes,a_,repeat,max_loop_size)
+
+
+def printTable(title,results):
+    """
+    Function that shows on screen the results of a benchmark
+    title: name of operation benchmarked
+    results: list of dictionaries as returned by benchPair
+    """
+    print(title)
+    print('%8s %12s %12s %10s %10s' % ('size','loop [s]','fast [s]','speedup','max err'))
+    for row in results:
+        loop_ = '%12.4f' % row['loop'] if row['loop'] is not None else '%12s' % '-'
+        speed_ = '%10.1f' % row['speedup'] if row['speedup'] is not None else '%10s' % '-'
+        err_ = '%10.2e' % row['max_err'] if row['max_err'] is not None else '%10s' % '-'
+        print('%8d %s %12.4f %s %s' % (row['size'],loop_,row['fast'],speed_,err_))
+
+
+OPERATIONS = ('reduce','expand','gauss','laplace','collapse','blend')
+IMPLEMENTATIONS = ('opencv','loop','scratch')
+LOOP_OPERATIONS = ('reduce','expand','gauss')
+
+
+def loopPyramid(A,a_,depth,dtype):
+    """
+    Function that builds the Gaussian pyramid of a matrix with the loop version GaussPyr3D
+    """
+    gauss_ = [A]
+    for _ in range(depth):
+        gauss_.append(gp.GaussPyr3D(gauss_[-1],a_,dtype))
+    return gauss_
+
+
+def makeCase(op,impl,A,B,depth,precision,a_,reference=False):
+    """
+    Function that prepares one benchmark case
+    op: operation, one of OPERATIONS
+    impl: implementation, one of IMPLEMENTATIONS
+    A, B: uint8 images; B is only used by the blend
+    depth: number of levels of the pyramids
+    precision: data types of the levels, see pyramid.PRECISIONS
+    a_: parameter that determines the from-scratch kernel
+    reference: if True the operation is done by OpenCV in float64, to measure deviations
+               against; impl and precision are then ignored
+    returns: function without arguments that performs the operation and returns its result
+    """
+    if reference:
+        # Float64 images keep every level float64 on the OpenCV path
+        impl = 'opencv'; precision = 'legacy'
+        A = A.astype(np.float64); B = B.astype(np.float64)
+        dtype_ = np.float64
+    else:
+        dtype_ = PRECISIONS[precision][0] or (np.float64 if impl != 'opencv' else np.uint8)
+    # Input of EXPAND: the REDUCE of the image
+    small_ = cv2.pyrDown(A.astype(np.float64)).astype(dtype_)
+    if impl == 'loop':
+        if op == 'reduce':
+            return lambda: gp.GaussPyr3D(A,a_,dtype_)
+        if op == 'expand':
+            return lambda: lp.LaplPyr3D(small_,a_,dtype_,A.shape)
+        if op == 'gauss':
+            return lambda: loopPyramid(A,a_,depth,dtype_)
+        raise ValueError("the loop implementation has no %s" % op)
+    if op == 'reduce':
+        if impl == 'opencv':
+            return lambda: cv2.pyrDown(A.astype(dtype_,copy=False))
+        return lambda: gp.fastGaussPyr3D(A,a_,dtype_)
+    if op == 'expand':
+        if impl == 'opencv':
+            return lambda: cv2.pyrUp(small_,dstsize=(A.shape[1],A.shape[0]))
+        return lambda: lp.fastLaplPyr3D(small_,a_,False,dtype_,A.shape)
+    if op == 'gauss':
+        return lambda: Pyramid(A,a_,impl,precision).gaussPyramid(depth)
+    if op == 'laplace':
+        return lambda: Pyramid(A,a_,impl,precision).laplacePyramid(depth)
+    if op == 'collapse':
+        pyr_ = Pyramid(A,a_,impl,precision)
+        lapl_ = pyr_.laplacePyramid(depth)
+        return lambda: fOCV.collapsePyramid(pyr_,lapl_)
+    if op == 'blend':
+        return lambda: fOCV.blendPyramids(Pyramid(A,a_,impl,precision),Pyramid(B,a_,impl,precision),depth)
+    raise ValueError("unknown operation %r" % (op,))
+
+
+def deviation(result,reference):
+    """
+    Function that measures how far a result is from the reference one
+    result, reference: matrices, or lists of matrices of the same shapes
+    returns: tuple (maximum absolute difference, mean absolute difference)
+    """
+    if not isinstance(result,list):
+        result = [result]; reference = [reference]
+    max_ = 0.; sum_ = 0.; count_ = 0
+    for x,y in zip(result,reference):
+        if x.shape != y.shape:
+            raise ValueError("shape %s differs from reference %s" % (x.shape,y.shape))
+        diff_ = np.abs(np.asarray(x,dtype=np.float64) - y)
+        max_ = max(max_,float(diff_.max())); sum_ += float(diff_.sum()); count_ += diff_.size
+    return max_,sum_/count_
+
+
+def peakMemory(func):
+    """
+    Function that measures the peak memory allocated by a call, if tracemalloc is available
+    func: function without arguments
+    returns: peak of allocated bytes, or None
+    """
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def runSuite(sizes,depths,precisions,operations=OPERATIONS,implementations=IMPLEMENTATIONS,
+             a_=0.375,repeat=3,max_loop_pixels=128*128,report=None):
+    """
+    Function that runs every combination of operation, implementation, size, depth and precision
+    sizes: list of (rows,cols) of the images
+    depths: list of numbers of levels of the pyramids
+    precisions: list of precisions, see pyramid.PRECISIONS
+    operations, implementations: subsets of OPERATIONS and IMPLEMENTATIONS
+    a_: kernel parameter of the from-scratch path; 0.375 is the kernel used by OpenCV
+    repeat: number of repetitions of each measurement; the minimum time is kept
+    max_loop_pixels: larger images are not run with the (very slow) loop implementation
+    report: optional function called with each result as soon as it is available
+    returns: list of dictionaries, one per case
+    """
+    results = []
+    for rows,cols in sizes:
+        A = randomImage(rows,cols,0); B = randomImage(rows,cols,1)
+        for op in operations:
+            # REDUCE and EXPAND do not depend on the depth
+            for depth in (depths if op not in ('reduce','expand') else depths[:1]):
+                # Reference: the same operation with OpenCV in float64
+                reference_ = makeCase(op,'opencv',A,B,depth,'legacy',a_,reference=True)()
+                for precision in precisions:
+                    for impl in implementations:
+                        row = {'op': op, 'impl': impl, 'rows': rows, 'cols': cols, 'depth': depth,
+                               'precision': precision, 'seconds': None, 'peak_bytes': None,
+                               'max_dev': None, 'mean_dev': None, 'error': None}
+                        # The loop implementation only has REDUCE and EXPAND, and takes
+                        # minutes on large images
+                        if impl == 'loop' and (op not in LOOP_OPERATIONS or rows*cols > max_loop_pixels):
+                            continue
+                        try:
+                            case_ = makeCase(op,impl,A,B,depth,precision,a_)
+                            row['seconds'] = timeCall(case_,(),1 if impl == 'loop' else repeat)
+                            row['peak_bytes'] = peakMemory(case_)
+                            row['max_dev'],row['mean_dev'] = deviation(case_(),reference_)
+                        except Exception as e:
+                            row['error'] = '%s: %s' % (type(e).__name__,e)
+                        results.append(row)
+                        if report is not None:
+                            report(row)
+    return results
+
+
+def printRow(row):
+    """
+    Function that shows on screen the result of one benchmark case
+    row: dictionary as returned by runSuite
+    """
+    case_ = '%-8s %-7s %5dx%-5d d=%-2d %-7s' % (row['op'],row['impl'],row['rows'],row['cols'],row['depth'],row['precision'])
+    if row['error'] is not None:
+        print(case_,' ERROR',row['error'])
+        return
+    peak_ = '%9.1f MB' % (row['peak_bytes']/2.**20) if row['peak_bytes'] is not None else '%12s' % '-'
+    print(case_,'%10.4f s %s  max dev %9.3g  mean dev %9.3g' % (row['seconds'],peak_,row['max_dev'],row['mean_dev']))
+
+
+def caseKey(row):
+    return (row['op'],row['impl'],row['rows'],row['cols'],row['depth'],row['precision'])
+
+
+def findRegressions(results,baseline,max_slowdown=1.25,dev_tolerance=1e-6):
+    """
+    Function that compares the results of a run with those of a previous one
+    results, baseline: lists of dictionaries as returned by runSuite
+    max_slowdown: cases slower than this factor times the baseline are regressions
+    dev_tolerance: cases whose maximum deviation grows more than this are regressions
+    returns: list of messages, one per regression
+    """
+    previous_ = dict((caseKey(row),row) for row in baseline)
+    messages = []
+    for row in results:
+        old_ = previous_.get(caseKey(row))
+        if old_ is None or old_['error'] is not None:
+            continue
+        name_ = '%s/%s %dx%d d=%d %s' % caseKey(row)
+        if row['error'] is not None:
+            messages.append('%s now fails: %s' % (name_,row['error']))
+            continue
+        if row['seconds'] > max_slowdown*old_['seconds']:
+            messages.append('%s is %.2fx slower' % (name_,row['seconds']/old_['seconds']))
+        if row['max_dev'] > old_['max_dev'] + dev_tolerance:
+            messages.append('%s deviates %.3g (was %.3g)' % (name_,row['max_dev'],old_['max_dev']))
+    return messages
+
+
+def parseSize(text):
+    """
+    Function that reads a size given as 'N' (square image) or 'ROWSxCOLS'
+    """
+    rows,_,cols = text.lower().partition('x')
+    return int(rows),int(cols or rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pyramid implementations')
+    parser.add_argument('--sizes',nargs='+',type=parseSize,default=[(128,128),(257,257),(300,211),(512,512),(1024,1024)],
+                        help="image sizes, as N or ROWSxCOLS")
+    parser.add_argument('--depths',nargs='+',type=int,default=[3,5])
+    parser.add_argument('--precisions',nargs='+',choices=sorted(PRECISIONS),default=['legacy','float32'])
+    parser.add_argument('--ops',nargs='+',choices=OPERATIONS,default=list(OPERATIONS))
+    parser.add_argument('--impls',nargs='+',choices=IMPLEMENTATIONS,default=list(IMPLEMENTATIONS))
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--a',dest='a_',type=float,default=0.375,help='kernel parameter of the from-scratch path')
+    parser.add_argument('--json',help='write the results to this file')
+    parser.add_argument('--compare',help='results of a previous run (--json) to check for regressions')
+    parser.add_argument('--max-slowdown',type=float,default=1.25)
+    parser.add_argument('--speedup',action='store_true',help='only print the loop vs vectorized REDUCE/EXPAND tables')
+    args = parser.parse_args(argv)
+
+    if args.speedup:
+        sizes = [rows for rows,cols in args.sizes]
+        printTable('REDUCE',benchReduce(sizes))
+        printTable('EXPAND',benchExpand(sizes))
+        return 0
+    results = runSuite(args.sizes,args.depths,args.precisions,args.ops,args.impls,args.a_,args.repeat,report=printRow)
+    if args.json:
+        with open(args.json,'w') as f:
+            json.dump(results,f,indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions_ = findRegressions(results,json.load(f),args.max_slowdown)
+        for message in regressions_:
+            print('REGRESSION',message)
+        return 1 if regressions_ else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
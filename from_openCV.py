@@ -1,7 +1,12 @@
+from __future__ import print_function
 import cv2
 import numpy as np,sys
 import os
 import math as mt
+import utilities as util
+from pyramid import Pyramid
+from image_writer import writeAll
+from profiling import stage, pixelsOf
 
 
 """
@@ -13,11 +18,11 @@ The process of generating the pyramids and blending is exeplored using OpenCV ex
 def get_GaussPyrimid(name,times):
     """
     Function that reduces a given image certain number of times
-    name: name of file containing the image
+    name: name of file containing the image, or its matrix
     times: number of times the image will be reduced
     """
-    # Read image from file using OpenCV
-    img = cv2.imread(name)
+    # Read image from file using OpenCV, unless it already is a matrix
+    img = util.readImage(name)
     # Create a list of images that initially contains only the original
     # image
     gaussPy = [img]
@@ -34,11 +39,11 @@ def get_GaussPyrimid(name,times):
 def get_GaussPyrimids(name1,name2,size):
     """
     Function that reduces two images certain number of times
-    name1, name2: names of files containing the images
+    name1, name2: names of files containing the images, or their matrices
     times: number of times the image will be reduced
     """
-    # Read images from corresponding files
-    img1 = cv2.imread(name1); img2 = cv2.imread(name2)
+    # Read images from corresponding files, unless they already are matrices
+    img1 = util.readImage(name1); img2 = util.readImage(name2)
     # Initialize two lists with corresponding images
     gaussPy1 = [img1]; gaussPy2 = [img2]
     # We reduce the image as many times as the user has requested ... 
@@ -49,85 +54,360 @@ def get_GaussPyrimids(name1,name2,size):
     return gaussPy1,gaussPy2
 
 
-def get_LaplacePyramid(name1,name2,size):
+def get_LaplacePyramid(name1,name2,size,precision='legacy'):
     """
     Function that creates Laplacian pyramids of two images
-    name1, name2: names of files containing the images
+    name1, name2: names of files containing the images, or their matrices
     size: number of levels in the lapalacian pyramid
+    precision: data types of the levels, see pyramid.PRECISIONS; 'legacy' keeps
+               the uint8 levels of cv2.subtract, which clips negative values
     """
-    # We first get the gaussian pyramids of each image. Notice 
-    # the function written before is invoked here
-    gaussPy1,gaussPy2 = get_GaussPyrimids(name1,name2,size)
-    # We create a list of Laplacian pyramids; we initialize each list 
-    # with the deeper level (smallest image) of each Gaussian pyramid
-    Lapl1 = [gaussPy1[size]]; Lapl2 = [gaussPy2[size]]
-    # We loop over each element of the Gaussian pyramid. Notice the 
-    # looping begins with the smallest image in the Gaussian pyramid 
-    # (deepest level)
-    # For each element of the Gaussian pyramid...
-    for k in range(size,0,-1):
-        # Increase size of images in turn...
-        G1 = cv2.pyrUp(gaussPy1[k]); G2 = cv2.pyrUp(gaussPy2[k])
-        #print G1.shape, G2.shape
-        # ... take respective differences with images in turn ...
-        L1 = cv2.subtract(gaussPy1[k-1],G1); L2 = cv2.subtract(gaussPy2[k-1],G2)
-        # ... and append to the list of Laplacian pyramids
-        #print k , L1.shape, L2.shape
-        Lapl1.append(L1); Lapl2.append(L2)
-    return Lapl1,Lapl2
-
-
-def blendImages(name1,name2,name_blend,size):
-    """
-    This function genearated the blending of two images.
+    # The pyramid of each image computes every Gaussian level once and
+    # shares it between the Gaussian and the Laplacian levels
+    pyr1 = Pyramid(util.readImage(name1),method='opencv',precision=precision)
+    pyr2 = Pyramid(util.readImage(name2),method='opencv',precision=precision)
+    # Each list starts with the deeper level (smallest image) of the Gaussian
+    # pyramid, followed by the Laplacian levels from the smallest to the largest
+    return pyr1.laplacePyramid(size),pyr2.laplacePyramid(size)
+
+
+def stitchHalves(la,lb):
+    """
+    Function that sews the left half of an image to the right half of another one
+    la, lb: images of the same shape
+    returns: sewed image
+    """
+    # We get dimension of images in turn ...
+    row,col = la.shape[:2]
+    # ... grab the left and right halves of corresponding elements...
+    left_img = la[:,0:col//2]; right_img = lb[:,col//2:]
+    # ... and stack them horizontally to do sewing
+    return np.hstack((left_img,right_img))
+
+
+def blendPyramids(pyrA,pyrB,size):
+    """
+    This function blends the images held by two pyramids.
     The blending takes place the middle part of each image
-    name1, name2: files' names containing images
-    name_blend: name of file containing the blended image
-    size: size of pyramids (number of levels in pyramids) generated
+    pyrA, pyrB: Pyramid objects of the images to be blended
+    size: size of pyramids (number of levels in pyramids) used
           to do the blending
+    returns: blended image; uint8 for OpenCV pyramids with 'legacy' precision, float otherwise
     """
     # Get Laplacian pyramids
-    lpA,lpB = get_LaplacePyramid(name1,name2,size)
+    lpA = pyrA.laplacePyramid(size); lpB = pyrB.laplacePyramid(size)
     # We intialize an empty list of images
     list_img = []
     # For each tuple in the cartesian product of Laplacian pyramids...
-    for la,lb in zip(lpA,lpB):
-         #row,col,dpt = la.shape
-        # We get dimension of element of Laplacian pyramid in turn ...
-        row,col = la.shape[:2]
-        # ... grab the left and right halves of corresponding elements...
-        left_img = la[:,0:col/2]; right_img = lb[:,col/2:]
-        # ... stack them horizontally to do sewing ...
-        ls = np.hstack((left_img,right_img))
+    for k,la,lb in zip(range(size,-1,-1),lpA,lpB):
+        # ... sew the left half of one to the right half of the other ...
+        with stage('stitch',k,pixelsOf(la)):
+            ls = stitchHalves(la,lb)
         # ... append the recently sewed image
         list_img.append(ls)
-    # We get the first element of sewed images... 
-    ls_ = list_img[0]
-    # ... and for the remaining elements in chaing of sewed images...
-    for item in list_img[1:]:
-        # ... increase the size ...
-        ls_ = cv2.pyrUp(ls_)
-        # ... and add it to the element in turn..
-        ls_ = cv2.add(ls_,item)
-            
-    cv2.imwrite(name_blend,ls_)
+    # Collapse the chain of sewed images
+    return collapsePyramid(pyrA,list_img)
+
+
+def collapsePyramid(pyr,levels):
+    """
+    This function collapses a Laplacian pyramid (e.g. a sewed one) back into an image,
+    G_k = EXPAND(G_k+1) + L_k, from the deepest level
+    pyr: Pyramid object whose EXPAND is used
+    levels: list [G_size, L_size-1, ..., L_0], as returned by Pyramid.laplacePyramid
+    returns: collapsed image. uint8 levels (OpenCV pyramids with 'legacy' precision) are
+             added with the saturating cv2.add, so they clip instead of wrapping around
+    """
+    # We get the first element of the chain of levels... 
+    ls_ = levels[0]
+    # ... and for the remaining elements in the chain...
+    for k,item in zip(range(len(levels)-2,-1,-1),levels[1:]):
+        with stage('collapse',k,pixelsOf(item)):
+            # ... increase the size ...
+            ls_ = pyr.expandLevel(ls_,item.shape)
+            # ... and add it to the element in turn..
+            if ls_.dtype == np.uint8 and item.dtype == np.uint8:
+                ls_ = cv2.add(ls_,item)
+            else:
+                ls_ = ls_ + item
+    return ls_
+
 
+def readMask(mask,shape):
+    """
+    Function that turns any accepted description of a blending mask into a float32 matrix
+    mask: name of a (grayscale) image file, a matrix, or a function f(rows,cols) that
+          returns a matrix; values are the weights of the first image, in [0,1] for
+          float matrices or [0,255] for uint8 ones
+    shape: shape of the images being blended
+    returns: two-dimensional float32 matrix of weights, of size shape[:2]
+    """
+    if callable(mask):
+        mask = mask(shape[0],shape[1])
+    elif isinstance(mask,str):
+        name_ = mask
+        mask = cv2.imread(name_,cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            raise IOError("could not read mask %r" % (name_,))
+    mask = np.asarray(mask)
+    scale_ = 255. if mask.dtype == np.uint8 else 1.
+    # A mask given with color channels is reduced to a single channel
+    if mask.ndim == 3:
+        mask = mask[:,:,0]
+    if mask.shape != tuple(shape[:2]):
+        raise ValueError("mask has shape %s but the images have %s" % (mask.shape,tuple(shape[:2])))
+    return (mask/scale_).astype(np.float32)
+
+
+def blendPyramidsMask(pyrA,pyrB,pyrM,size):
+    """
+    This function blends the images held by two pyramids with an arbitrary soft mask.
+    Every level of the output is M_k*LA_k + (1-M_k)*LB_k, where M_k is the kth level of
+    the Gaussian pyramid of the mask; it is written in place into a single buffer per level,
+    which is also the one the collapse accumulates into
+    pyrA, pyrB: Pyramid objects of the images to be blended
+    pyrM: Pyramid object of the mask, as returned by readMask
+    size: size of pyramids (number of levels in pyramids) used to do the blending
+    returns: float32 blended image
+    """
+    # Get Laplacian pyramids; each one starts with the deepest Gaussian level
+    lpA = pyrA.laplacePyramid(size); lpB = pyrB.laplacePyramid(size)
+    ls_ = None
+    for k,la,lb in zip(range(size,-1,-1),lpA,lpB):
+        # Weights of the first image at this level, broadcast over the BGR channels
+        mk_ = pyrM.gauss(k)
+        if la.ndim == 3:
+            mk_ = mk_[:,:,None]
+        # level = (LA - LB)*M + LB, in the only buffer allocated for this level
+        with stage('blend',k,pixelsOf(la)):
+            level_ = np.subtract(la,lb,dtype=np.float32)
+            np.multiply(level_,mk_,out=level_)
+            np.add(level_,lb,out=level_,casting='unsafe')
+        # Collapse: add the expansion of the previous (smaller) result
+        if ls_ is not None:
+            with stage('collapse',k,pixelsOf(level_)):
+                np.add(level_,pyrA.expandLevel(ls_,level_.shape),out=level_,casting='unsafe')
+        ls_ = level_
+    return ls_
+
+
+def blendMany(images,masks,size,method='opencv',a_=0.4,precision='float32'):
+    """
+    This function blends any number of images in a single pyramid pass. The Laplacian
+    pyramid of each input is built once and its levels, weighted by the Gaussian pyramid
+    of its mask, are accumulated into one output pyramid; the accumulated weights then
+    normalize every level and the output pyramid is collapsed a single time. Inputs are
+    consumed one at a time, so only one input pyramid is held in memory at once
+    images: iterable of images, given as matrices or names of files
+    masks: iterable with the weights of each image (see readMask), or None to weight all
+           images equally; masks need not add up to one, they are normalized per level
+    size: size of pyramids (number of levels in pyramids) used to do the blending
+    method, a_, precision: see pyramid.Pyramid
+    returns: float32 blended image
+    """
+    levels_ = None; weights_ = None
+    maskIter = iter(masks if masks is not None else ())
+    for img in images:
+        pyrI = Pyramid.fromFile(img,a_,method,precision) if isinstance(img,str) else Pyramid(img,a_,method,precision)
+        shape_ = pyrI.gauss(0).shape
+        mask_ = next(maskIter,None)
+        if mask_ is None:
+            mask_ = np.ones(shape_[:2],dtype=np.float32)
+        pyrM = Pyramid(readMask(mask_,shape_),a_,method)
+        lpI = pyrI.laplacePyramid(size)
+        # Output and weight pyramids are allocated with the first input
+        if levels_ is None:
+            levels_ = [np.zeros(l.shape,dtype=np.float32) for l in lpI]
+            weights_ = [np.zeros(l.shape[:2],dtype=np.float32) for l in lpI]
+        # Accumulate the weighted levels, deepest first
+        for i,(k,l) in enumerate(zip(range(size,-1,-1),lpI)):
+            mk_ = pyrM.gauss(k)
+            weights_[i] += mk_
+            levels_[i] += l*(mk_[:,:,None] if l.ndim == 3 else mk_)
+        # The pyramids of this input are no longer needed
+        del pyrI, pyrM, lpI
+    if levels_ is None:
+        raise ValueError("no images to blend")
+    # Normalize every level by the total weight; pixels with no weight stay at zero
+    for level_,w_ in zip(levels_,weights_):
+        w_ = w_[:,:,None] if level_.ndim == 3 else w_
+        np.divide(level_,w_,out=level_,where=w_ > 0)
+    # Collapse the output pyramid, accumulating in place; the pyramid object
+    # below is only used for its EXPAND
+    expander_ = Pyramid(levels_[-1],a_,method,precision)
+    ls_ = levels_[0]
+    for level_ in levels_[1:]:
+        np.add(level_,expander_.expandLevel(ls_,level_.shape),out=level_,casting='unsafe')
+        ls_ = level_
+    return ls_
+
+
+def toImage(A):
+    """
+    Function that converts a floating point image to uint8, rounding and clipping to [0,255]
+    A: image
+    returns: uint8 image; A itself if it already was uint8
+    """
+    if A.dtype == np.uint8:
+        return A
+    return np.clip(np.rint(A),0,255).astype(np.uint8)
 
 
-def makeSequenceBlends(name1,name2,max_size):
+def blendArrays(img1,img2,size,precision='legacy',mask=None):
+    """
+    This function blends two images given as matrices and returns the result, without
+    touching the disk. The blending takes place the middle part of each image, unless a
+    mask is given
+    img1, img2: matrices of the images (names of files are read as well)
+    size: size of pyramids (number of levels in pyramids) generated
+          to do the blending
+    precision: data types of the pyramid levels, see pyramid.PRECISIONS. With a mask,
+               'float32' or 'int16' keep the negative Laplacian detail
+    mask: optional soft mask with the weights of the first image, see readMask
+    returns: uint8 blended image
+    """
+    pyrA = Pyramid(util.readImage(img1),method='opencv',precision=precision)
+    pyrB = Pyramid(util.readImage(img2),method='opencv',precision=precision)
+    if mask is None:
+        blend_ = blendPyramids(pyrA,pyrB,size)
+    else:
+        pyrM = Pyramid(readMask(mask,pyrA.gauss(0).shape),method='opencv')
+        blend_ = blendPyramidsMask(pyrA,pyrB,pyrM,size)
+    return toImage(blend_)
+
+
+def blendImages(name1,name2,name_blend,size,precision='legacy',mask=None):
+    """
+    This function genearated the blending of two images and writes it to file; see
+    blendArrays, which does the blending in memory
+    name1, name2: files' names containing images, or their matrices
+    name_blend: name of file containing the blended image
+    size: size of pyramids (number of levels in pyramids) generated
+          to do the blending
+    precision, mask: see blendArrays
+    NOTE. Raises IOError if the blended image cannot be written
+    """
+    blend_ = blendArrays(name1,name2,size,precision,mask)
+    with stage('encode',pixels=pixelsOf(blend_)):
+        if not cv2.imwrite(name_blend,blend_):
+            raise IOError("could not write image %r" % (name_blend,))
+
+
+
+def seamCorrection(gA,gB,shape):
+    """
+    Function that computes, around the seam, the difference D = EXPAND(sew(gA,gB)) - sew(EXPAND(gA),EXPAND(gB)).
+    Writing sew(A,B) = B + H*(A-B), with H = 1 on the left half, D = EXPAND(H*(gA-gB)) - H*EXPAND(gA-gB),
+    which is zero away from the seam; only a few columns at each side of it are computed
+    gA, gB: levels k+1 of the Gaussian pyramids of the images being blended
+    shape: shape of level k
+    returns: tuple (D restricted to columns [x0,x1) of level k, x0, x1)
+    """
+    width_ = gA.shape[1]; half_ = width_//2
+    # Window of level k+1 around its seam; four columns at each side are enough for
+    # the columns of level k where D is not zero
+    u0 = max(half_-4,0); u1 = min(half_+4,width_)
+    delta_ = gA[:,u0:u1] - gB[:,u0:u1]
+    leftDelta = delta_.copy(); leftDelta[:,half_-u0:] = 0
+    # Columns of level k obtained from the window, keeping the image borders if reached
+    dw_ = shape[1] - 2*u0 if u1 == width_ else 2*(u1-u0)
+    corr_ = cv2.pyrUp(leftDelta,dstsize=(dw_,shape[0]))
+    expDelta = cv2.pyrUp(delta_,dstsize=(dw_,shape[0]))
+    # Only the left half of level k keeps its expanded difference
+    corr_[:,:max(shape[1]//2-2*u0,0)] -= expDelta[:,:max(shape[1]//2-2*u0,0)]
+    # Discard the columns whose kernel reached outside of the window
+    a_ = 2 if u0 > 0 else 0
+    b_ = dw_ - 2 if u1 < width_ else dw_
+    return corr_[:,a_:b_],2*u0 + a_,2*u0 + b_
+
+
+def expandBand(band,x0,x1,shape):
+    """
+    Function that expands (cv2.pyrUp) an image that is zero everywhere except in a
+    band of columns, working only on the band and a small margin around it
+    band: nonzero columns [x0,x1) of the image
+    x0, x1: first and one past the last column of the band
+    shape: shape of the expanded (full) image
+    returns: tuple (expanded band, new x0, new x1)
+    """
+    width_ = (shape[1]+1)//2
+    # Two zero columns at each side are enough for the kernel of cv2.pyrUp;
+    # at the borders of the image its own border handling is kept
+    a_ = max(x0-2,0); b_ = min(x1+2,width_)
+    padded = np.zeros((band.shape[0],b_-a_) + band.shape[2:],dtype=band.dtype)
+    padded[:,x0-a_:x1-a_] = band
+    dw_ = shape[1] - 2*a_ if b_ == width_ else 2*(b_-a_)
+    return cv2.pyrUp(padded,dstsize=(dw_,shape[0])),2*a_,2*a_ + dw_
+
+
+def blendSequence(pyrA,pyrB,max_size):
+    """
+    Generator of the sequence of blends of depth 0,...,max_size-1, computed incrementally.
+    In exact arithmetic the blend of depth s+1 differs from the blend of depth s by
+    EXPAND^s(D_s), where D_s = EXPAND(sew(G_s+1)) - sew(EXPAND(G_s+1)) lives at level s.
+    So every blend is obtained from the previous one by adding a single correction,
+    instead of stitching and collapsing the whole pyramid again. D_s is only nonzero
+    around the seam, so the correction is computed and expanded on that band of columns
+    pyrA, pyrB: Pyramid objects of the images to be blended
+    max_size: number of blends in the sequence
+    yields: float32 blended image of each depth
+    NOTE. The blends are computed in floating point, without the saturating uint8
+    cv2.subtract/cv2.add of blendPyramids, so negative Laplacian detail is kept.
+    The yielded array is updated in place by the next iteration; copy it to keep it
+    """
+    # A blend of depth zero just sews both original images
+    blend = stitchHalves(pyrA.gauss(0),pyrB.gauss(0)).astype(np.float32)
+    yield blend
+    for s in range(max_size-1):
+        # Correction at level s, around the seam ...
+        gA = pyrA.gauss(s+1).astype(np.float32); gB = pyrB.gauss(s+1).astype(np.float32)
+        corr_,x0,x1 = seamCorrection(gA,gB,pyrA.gauss(s).shape)
+        # ... taken up to the size of the original image ...
+        for j in range(s-1,-1,-1):
+            corr_,x0,x1 = expandBand(corr_,x0,x1,pyrA.gauss(j).shape)
+        # ... and added to the previous blend
+        blend[:,x0:x1] += corr_
+        yield blend
+
+
+def makeSequenceBlends(name1,name2,max_size,incremental=False,writer=None,precision=None):
     """
     Function that generates a sequence of blended images
     name1, name2: names of files containing the images to be blended
     max_size: maximum size of pyramids genereted for blending
+    incremental: if True each blend is derived from the previous one with
+                 blendSequence, instead of collapsing a full pyramid every time
+    writer: optional image_writer.ImageWriter (e.g. to choose the format); by default
+            one is created. Each blend is encoded in the background while the next one
+            is computed, and all of them are on disk when the function returns
+    precision: data types of the pyramid levels, see pyramid.PRECISIONS; by default
+               'legacy' (saturating uint8 levels), or 'float32' if incremental
+    NOTE. blendSequence works in floating point, so incremental=True only supports
+    precision 'float32', and writes the same blends as incremental=False with that
+    precision (up to one grey level where float rounding crosses a half). They differ
+    from the default 'legacy' blends, whose negative Laplacian detail is clipped
     """
-    # For all levels of blending ...
-    for size in range(max_size):
-        # Generate name of file containing blended image in turn
-        output_name = 'blend_0'+ str(size) +'.jpg'
-        # Show name of file on screen...
-        print output_name
-        # ... and perform the blending itself
-        blendImages(name1,name2,output_name,size)
-
+    if precision is None:
+        precision = 'float32' if incremental else 'legacy'
+    if incremental and precision != 'float32':
+        raise ValueError("incremental blends are computed in float32, got precision %r" % (precision,))
+    # The images are read and their pyramids built only once; every blend
+    # below reuses the levels computed for the previous ones
+    pyrA = Pyramid.fromFile(name1,method='opencv',precision=precision)
+    pyrB = Pyramid.fromFile(name2,method='opencv',precision=precision)
+    if incremental:
+        blends = (toImage(b) for b in blendSequence(pyrA,pyrB,max_size))
+    else:
+        blends = (toImage(blendPyramids(pyrA,pyrB,size)) for size in range(max_size))
 
+    def outputs():
+        # For all levels of blending ...
+        for size,blend in enumerate(blends):
+            # Generate name of file containing blended image in turn
+            output_name = 'blend_0'+ str(size) +'.jpg'
+            # Show name of file on screen...
+            print(output_name)
+            # ... and hand the blending itself to the writer
+            yield output_name,blend
 
+    writeAll(writer,outputs())
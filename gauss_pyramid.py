@@ -1,5 +1,9 @@
+from __future__ import print_function
 import cv2
 import numpy as np
+import utilities as util
+from image_writer import writeAll
+from profiling import stage, reducedPixels
 
 """
 This module generates a Gaussian pyramid from scratch. OpenCV is only used
@@ -49,35 +53,35 @@ def convPyrA(xTest,wHat):
     # For the edges the kernel has to be reduced in order to have overlap
     # with the vector; we collect the "right-hand side" of kernel
     # and store it auxiliary variable
-    wAux = np.array(wHat[2:])
-    # Perform inner product for convultion and correct result 
-    # to ensure our reduced kernel was normalized
-    xReduced[0] = np.dot(wAux,aux_)/sum(wAux)
+    # The renormalized edge kernel is computed once per kernel, see reduceWeights
+    wAux = util.KERNEL_CACHE.get(('reduce',tuple(wHat),np.dtype(np.float64).str),lambda: reduceWeights(wHat))[1]
+    # Perform inner product for convultion; the reduced kernel is already normalized
+    xReduced[0] = np.dot(wAux,aux_)
     # We proceed in a similar fashion for last index
     aux_ = np.array(xTest[len(xTest)-3:])
     # This time the kernel is same as before but in opposite order, [::-1]
     wAux = wAux[::-1]
-    # As before, we compute inner product for convolution and normalize
-    # kernel
-    xReduced[len_-1] = np.dot(wAux,aux_)/sum(wAux)
+    # As before, we compute inner product for convolution
+    xReduced[len_-1] = np.dot(wAux,aux_)
     
     return np.array(xReduced)
     
 
 
-def convPyrMatrix(A,wHat):
+def convPyrMatrix(A,wHat,dtype=np.float64):
     """
     This function extends the capabilities of convPyrA(xTest,wHat) to
     make it useful for matrices 
     A: image matrix to be reduced
     wHat: kernel to perform the convolution
+    dtype: data type of the reduced image
     returns: matrix representing the reduced image
     NOTE. This function assumes the matrix A is two-dimensional
     """
     # We get number of rows and columns of given matrix A ...
     rowsA,colsA = A.shape[:2]
     # ... and set a matrix of zeros with the same shape
-    Afinal = np.zeros((rowsA,colsA))
+    Afinal = np.zeros((rowsA,colsA),dtype=dtype)
 
     # WE FIRST CONVOLUTE ROWS:
     for k in range(rowsA):
@@ -99,53 +103,170 @@ def convPyrMatrix(A,wHat):
         aux_ = convPyrA(vec_,wHat)
         colsAux =  aux_.shape[0]
         Afinal[:colsAux,k] = aux_
-            
-    return Afinal[:rowsAux,:colsAux]
+    
+    # rowsAux is the number of reduced columns and colsAux the number of reduced rows
+    return Afinal[:colsAux,:rowsAux]
 
 
-def GaussPyr3D(A,a_):
+def GaussPyr3D(A,a_,dtype=np.float64):
     """
     This function uses the previosuly implemented function, convPyrMatrix(A,wHat),
     to apply it to a three-dimensional matrix as the ones provided by OpenCV.
     Remember that the third index in matrix A is related with BGR of the pixel (x,y)
     A: three-dimensional matrix representation of an image
     a_: Parameter that uniquely defines the kernel
+    dtype: data type of the reduced image
     returns: three-dimensional matrix representing reduced image
     """
-    # The kernel is defined
-    wHat = np.array([0.25 - (a_/2),0.25,a_,0.25,0.25-(a_/2)])
+    # The kernel is defined once per a_ and shared by every call
+    wHat = util.cachedKernel(a_)
     #aux = aApple[:,:,0]
     
     # Apply the "two-dimensional" function to the "B" color, index 0
-    aux = convPyrMatrix(A[:,:,0],wHat)
+    aux = convPyrMatrix(A[:,:,0],wHat,dtype)
     # Get shape of resulting matrix and set a three-dimensional
     # matrix of zeros accordingly
     rows,cols = aux.shape
-    Afin = np.zeros((rows,cols,3))
+    Afin = np.zeros((rows,cols,3),dtype=dtype)
     # Store result in the corresponding "B" color of reduced matrix
     Afin[:,:,0] = aux
     # Repeat the same process but this time for "G" and "R" color indices
     for k in range(1,3):
-        aux = convPyrMatrix(A[:,:,k],wHat)
+        aux = convPyrMatrix(A[:,:,k],wHat,dtype)
         Afin[:,:,k] = aux
     return Afin
 
 
-def MatrixGaussPyramid(name,a_,size):
+def reduceWeights(wHat,dtype=np.float64):
+    """
+    Function that precomputes the weights used by reduceAxis
+    wHat: kernel used for convolution
+    dtype: floating point type of the weights
+    returns: tuple (kernel, edge kernel); the edge kernel is [wHat[2],wHat[3],wHat[4]]
+             renormalized, as convPyrA uses for the first entry (reversed for the last)
+    """
+    wAux = np.array(wHat[2:],dtype=np.float64)
+    return np.array(wHat,dtype=dtype),(wAux/sum(wAux)).astype(dtype)
+
+
+def reduceAxis(A,wHat,axis=0,dtype=np.float64,workers=None):
+    """
+    Vectorized version of convPyrA(xTest,wHat) that reduces every line of an
+    array along the given axis at once, instead of one vector at a time
+    A: array to be reduced; any number of dimensions
+    wHat: kernel used for convolution
+    axis: axis along which the array is reduced
+    dtype: floating point type used for the computation and the result
+    workers: number of threads the lines are split over; None uses utilities.setNumWorkers
+    returns: array whose length along axis is half (rounded up) of the original
+    NOTE. The edges are handled exactly as in convPyrA: the kernel is cut to
+    [wHat[2],wHat[3],wHat[4]] and renormalized; the last entry is centered at
+    the last sample of the input
+    """
+    util.checkFloatType(dtype)
+    # Move the axis to be reduced to the front so every slice below
+    # addresses whole rows (or columns) of the array
+    X = np.moveaxis(np.asarray(A,dtype=dtype),axis,0)
+    # Kernel cast to dtype and the renormalized edge kernel, built once per kernel
+    wHat,wEdge = util.KERNEL_CACHE.get(('reduce',tuple(wHat),np.dtype(dtype).str),lambda: reduceWeights(wHat,dtype))
+    n = X.shape[0]
+    # Length of reduced vector, as in convPyrA
+    len_ = n//2 if n%2 == 0 else (n//2) + 1
+    Xreduced = np.empty((len_,) + X.shape[1:],dtype=dtype)
+
+    def reduceStrip(lo,hi):
+        # Reduce the lines [lo,hi) of the second axis; they are independent of the rest
+        Xs = X[:,lo:hi] if X.ndim > 1 else X
+        Xr = Xreduced[:,lo:hi] if X.ndim > 1 else Xreduced
+        # Interior entries: the ith entry is the inner product of the kernel with
+        # samples [2i-2,...,2i+2]. Instead of looping over i we take, for each tap k
+        # of the kernel, the strided slice of all the samples it multiplies
+        m = len_ - 2
+        if m > 0:
+            aux_ = wHat[0]*Xs[0:2*m-1:2]
+            for k in range(1,5):
+                aux_ += wHat[k]*Xs[k:k+2*m-1:2]
+            Xr[1:len_-1] = aux_
+        # Edges: reduced and renormalized kernel, first and last three samples
+        Xr[0] = wEdge[0]*Xs[0] + wEdge[1]*Xs[1] + wEdge[2]*Xs[2]
+        Xr[len_-1] = wEdge[2]*Xs[n-3] + wEdge[1]*Xs[n-2] + wEdge[0]*Xs[n-1]
+
+    util.parallelStrips(reduceStrip,X.shape[1] if X.ndim > 1 else 1,workers,X.size)
+    # Put the reduced axis back in its original position
+    return np.moveaxis(Xreduced,0,axis)
+
+
+def fastGaussPyr3D(A,a_,dtype=np.float64,workers=None):
+    """
+    Vectorized counterpart of GaussPyr3D(A,a_). Rows and columns are reduced
+    with reduceAxis(A,wHat,axis), so all the BGR channels are processed in the
+    same pass
+    A: two- or three-dimensional matrix representation of an image
+    a_: Parameter that uniquely defines the kernel
+    dtype: floating point type of the reduced image; float32 halves its memory
+    workers: number of threads each pass is split over; None uses utilities.setNumWorkers
+    returns: matrix representing reduced image, same values as GaussPyr3D
+    NOTE. Unlike convPyrMatrix, non-square images keep their orientation
+    """
+    wHat = util.cachedKernel(a_)
+    # Same order as convPyrMatrix: rows are convoluted first, then columns
+    return reduceAxis(reduceAxis(A,wHat,1,dtype,workers),wHat,0,dtype,workers)
+
+
+def fastGaussBatch(S,a_,dtype=np.float64,workers=None):
+    """
+    Batched counterpart of fastGaussPyr3D(A,a_): reduces a whole stack of images of the
+    same size with one vectorized REDUCE per axis, instead of one image at a time
+    S: stack of images, of shape (N,rows,cols) or (N,rows,cols,channels)
+    a_: Parameter that uniquely defines the kernel
+    dtype: floating point type of the reduced images
+    workers: number of threads each pass is split over; None uses utilities.setNumWorkers
+    returns: stack of reduced images; image i is fastGaussPyr3D(S[i],a_,dtype)
+    """
+    wHat = util.cachedKernel(a_)
+    return reduceAxis(reduceAxis(S,wHat,2,dtype,workers),wHat,1,dtype,workers)
+
+
+def batchGaussPyramid(S,a_,size,dtype=np.float64,workers=None):
+    """
+    Function that generates the Gaussian pyramids of a stack of images of the same size
+    at once, one fastGaussBatch per level
+    S: stack of images, of shape (N,rows,cols) or (N,rows,cols,channels); a list of
+       images of the same shape is stacked
+    a_: parameter that determines kernel
+    size: number of times the images are reduced
+    dtype: data type of the reduced levels
+    workers: see fastGaussBatch
+    returns: list with the stacks of levels 0,...,size; level k of image i is [k][i]
+    """
+    GaussPyr = [np.asarray(S)]
+    for k in range(size):
+        with stage('reduce',k+1,GaussPyr[-1].shape[0]*reducedPixels(GaussPyr[-1][0])):
+            GaussPyr.append(fastGaussBatch(GaussPyr[-1],a_,dtype,workers))
+    return GaussPyr
+
+
+def MatrixGaussPyramid(name,a_,size,fast=False,dtype=np.float64):
     """
     Function that generates a list containing a Gaussian pyramid from the name of the file containing 
-    the image
-    name: name of file containing image
+    the image, or from the image itself
+    name: name of file containing image, or its matrix (kept as level 0 without a copy)
     a_: parameter that determines kernel
     size: size of pyramid; number of levels in pyramid
+    fast: if True the levels are computed with the vectorized fastGaussPyr3D
+    dtype: floating point type of the reduced levels
     """
-    # Get matrix of image from its file
-    Aimg = cv2.imread(name)
+    util.checkFloatType(dtype)
+    # Pick the function that reduces one level
+    reduce_ = fastGaussPyr3D if fast else GaussPyr3D
+    # Get matrix of image, from its file if needed
+    Aimg = util.readImage(name)
     # Initialize list with original image
     GaussPyr = [Aimg]
     # Iterate to determine gaussian pyramid..
     for k in range(size):
-        Aimg = GaussPyr3D(Aimg,a_)
+        with stage('reduce',k+1,reducedPixels(Aimg)):
+            Aimg = reduce_(Aimg,a_,dtype)
         GaussPyr.append(Aimg)
     return GaussPyr
 
@@ -153,14 +274,15 @@ def MatrixGaussPyramid(name,a_,size):
 def reduceImage(name_input,name_output):
     """
     Function that takes an image and reduces it by colvolution
-    name_input: name if image to be reduced
+    name_input: name if image to be reduced, or its matrix
     name_output: name of resulting image
     returns: None, but saves to file the resulting image
+    NOTE. GaussPyr3D(A,0.4) returns the same reduced image without writing it
     """
     # Set "customary" value of parameter for kernel
     a_ = 0.4
     # Load matrix corresponding to original image
-    Ainput = cv2.imread(name_input)
+    Ainput = util.readImage(name_input)
     # Apply the reduce function to matrix...
     Aoutput = GaussPyr3D(Ainput,a_)
     # ... and save it to file with chose name
@@ -168,23 +290,31 @@ def reduceImage(name_input,name_output):
 
 
 
-def reduceImageSequence(name_input,size):
+def reduceImageSequence(name_input,size,writer=None):
     """
     This function generates a sequence of reduced images
-    name_input: name of original image
+    name_input: name of original image, or its matrix
     size: size of Gaussian pyramid; number of times the image will be reduced
+    writer: optional image_writer.ImageWriter (e.g. to choose the format); by default
+            one is created. Each image is encoded in the background while the next
+            one is reduced, and all of them are on disk when the function returns
     returns: none, but writes each image of sequence to file
+    NOTE. MatrixGaussPyramid(A,0.4,size-1) returns the same sequence without writing it
     """
     # Set value of parameter for kernel
     a_ = 0.4
-    # Load matrix corresponding to image
-    Aimg = cv2.imread(name_input)
-    # For every level in pyramid...
-    for k in range(size):
-        # Set the name of file...
-        name_output = 'reduced_0' + str(k) + '.jpg' 
-        # and write to file
-        cv2.imwrite(name_output,Aimg)
-        print "Image " , name_output , "with size ", Aimg.shape[:2] ,"has been created"
-        # reduce matrix
-        Aimg = GaussPyr3D(Aimg,a_)
\ No newline at end of file
+
+    def levels():
+        # Load matrix corresponding to image
+        Aimg = util.readImage(name_input)
+        # For every level in pyramid...
+        for k in range(size):
+            # Set the name of file and hand the image to the writer
+            name_output = 'reduced_0' + str(k) + '.jpg'
+            yield name_output,Aimg
+            print("Image ", name_output, "with size ", Aimg.shape[:2], "has been created")
+            # reduce matrix, while the previous one is encoded
+            if k < size-1:
+                Aimg = GaussPyr3D(Aimg,a_)
+
+    writeAll(writer,levels())
@@ -0,0 +1,136 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from profiling import stage, pixelsOf
+
+"""
+This module writes images to file in the background. Encoding a JPEG or PNG
+often takes as long as computing a pyramid level, so the functions that dump
+levels or blends hand every image to an ImageWriter and go on computing the
+next one while a pool of threads encodes it
+"""
+
+
+class ImageWriter(object):
+    """
+    Writer of images on a pool of background threads, with a bounded number of
+    images waiting to be written. write() only blocks when that bound is reached.
+    Errors of the background writes are raised by flush() (and by the next write()),
+    and flush() returns once every image submitted so far is on disk
+    """
+
+    def __init__(self,workers=2,max_pending=None,ext=None,jpeg_quality=None,png_compression=None):
+        """
+        workers: number of threads that encode and write images
+        max_pending: maximum number of images submitted but not yet written; by default
+                     twice the number of workers. Each pending image is kept in memory
+        ext: if given, e.g. '.png' or '.npy', replaces the extension of every name written
+        jpeg_quality: quality (0-100) of JPEG files; OpenCV's default if None
+        png_compression: compression level (0-9) of PNG files; OpenCV's default if None
+        NOTE. Files with extension .npy are written with np.save, without any conversion
+        """
+        self.ext = ext
+        self._params = {}
+        if jpeg_quality is not None:
+            self._params['.jpg'] = self._params['.jpeg'] = [cv2.IMWRITE_JPEG_QUALITY,int(jpeg_quality)]
+        if png_compression is not None:
+            self._params['.png'] = [cv2.IMWRITE_PNG_COMPRESSION,int(png_compression)]
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending or 2*workers)
+        self._lock = threading.Lock()
+        self._futures = []
+        self._errors = []
+
+    def _write(self,name,image):
+        try:
+            with stage('encode',pixels=pixelsOf(image)):
+                if os.path.splitext(name)[1].lower() == '.npy':
+                    np.save(name,image)
+                elif not cv2.imwrite(name,image,self._params.get(os.path.splitext(name)[1].lower(),[])):
+                    raise IOError("could not write image %r" % (name,))
+        except Exception as e:
+            with self._lock:
+                self._errors.append(e)
+        finally:
+            self._slots.release()
+
+    def write(self,name,image):
+        """
+        Function that submits an image to be written in the background
+        name: name of file; its extension selects the format unless the writer has one
+        image: matrix of the image. It is not copied, so it must not be modified until
+               it has been written (see flush)
+        returns: name of the file that will be written
+        """
+        self._raiseErrors()
+        if self.ext is not None:
+            name = os.path.splitext(name)[0] + self.ext
+        # Wait for a free slot, so at most max_pending images are held in memory
+        self._slots.acquire()
+        with self._lock:
+            self._futures.append(self._pool.submit(self._write,name,image))
+        return name
+
+    def _raiseErrors(self):
+        with self._lock:
+            errors_,self._errors = self._errors,[]
+        if errors_:
+            if len(errors_) > 1:
+                raise IOError("%d images could not be written; the first error was: %s" % (len(errors_),errors_[0]))
+            raise errors_[0]
+
+    def flush(self):
+        """
+        Function that waits until every image submitted so far has been written
+        NOTE. Raises the error of any write that failed since the last flush
+        """
+        with self._lock:
+            futures_,self._futures = self._futures,[]
+        for future_ in futures_:
+            future_.result()
+        self._raiseErrors()
+
+    def close(self):
+        """
+        Function that flushes the writer and stops its threads
+        """
+        try:
+            self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Do not hide the exception being raised behind a write error
+            try:
+                self.close()
+            except Exception:
+                pass
+        return False
+
+
+def writeAll(writer,items):
+    """
+    Function that writes a sequence of images with a writer and waits until all are on disk
+    writer: ImageWriter, or None to create one that is flushed and closed when done
+    items: iterable of (name, image) pairs; it is consumed lazily, so the next image can
+           be computed while the previous ones are being encoded
+    returns: list with the names of the files written
+    """
+    own_ = writer is None
+    if own_:
+        writer = ImageWriter()
+    try:
+        names_ = [writer.write(name,image) for name,image in items]
+        writer.flush()
+    finally:
+        if own_:
+            writer._pool.shutdown(wait=True)
+    return names_
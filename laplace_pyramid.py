@@ -1,7 +1,10 @@
+from __future__ import print_function
 import cv2
 import numpy as np
 import utilities as util
-from gauss_pyramid import MatrixGaussPyramid 
+from image_writer import writeAll
+from profiling import stage, pixelsOf
+from gauss_pyramid import MatrixGaussPyramid, fastGaussPyr3D, batchGaussPyramid
 import math as mt
 
 """
@@ -11,13 +14,15 @@ to load/write images from/to file.
 
 # Needs improvement
 
-def testConvIndx(wHat,yTest,indx):
+def testConvIndx(wHat,yTest,indx,length=None):
     """
     This function finds the ith component of the extended vector that resuluts from convoluting
     yTest with kernel wHat
     wHat: kernel
     yTest: Vector to be extended
     indx: component of resulting extended vector
+    length: length of the extended vector, 2n-1 or 2n for yTest of length n; by default
+            2n-1 for odd n and 2n for even n
     returns: ith component of extended vector resulting from the convolution wHat*yTest
     """
     if len(yTest)%2==0:
@@ -26,6 +31,9 @@ def testConvIndx(wHat,yTest,indx):
         max_ = len(yTest)
     
     yExtended = np.insert(yTest,[i for i in range(1,max_)],0)
+    # Drop or add the trailing zero so the extended vector has the requested length
+    if length is not None and length != len(yExtended):
+        yExtended = yExtended[:length] if length < len(yExtended) else np.append(yExtended,0)
     
     if indx == 0:
         yReduced = yExtended[:3]
@@ -61,53 +69,67 @@ def testConvIndx(wHat,yTest,indx):
 
 
 
-def extendVect(yTest,wHat):
+def extendVect(yTest,wHat,length=None):
     """
     Function that determines the vector resulting from the convolution of yTest and wHat
     yTest: vector to be extended
     wHat: kernel vector
+    length: length of the result, 2n-1 or 2n for yTest of length n (e.g. the length of
+            the vector yTest was reduced from); if None it is guessed as below
     returns: vector resulting from the convolution yTest*wHat
     """
-    # Since the size of the image is given by 2^N + 1  or 2^N we find the power N
-    len_ = int(mt.floor(mt.log(len(yTest),2)))
-    # According to the oddity of length of the image we extend it by changing 
-    # the power from N to N + 1
-    if len(yTest)%2 == 0:
-        len_ = 2**(len_+1)
+    if length is not None:
+        if length not in (2*len(yTest)-1,2*len(yTest)):
+            raise ValueError("a vector of length %d can only be extended to %d or %d, not %d"
+                             % (len(yTest),2*len(yTest)-1,2*len(yTest),length))
+        len_ = length
     else:
-        len_ = (2**(len_+1)) + 1
+        # Since the size of the image is given by 2^N + 1  or 2^N we find the power N
+        len_ = int(mt.floor(mt.log(len(yTest),2)))
+        # According to the oddity of length of the image we extend it by changing 
+        # the power from N to N + 1
+        if len(yTest)%2 == 0:
+            len_ = 2**(len_+1)
+        else:
+            len_ = (2**(len_+1)) + 1
     # Set a list of the resulting dimension 2^(N+1) + 1
     xOut = [0]*len_
     # We compute every component of the convolution...
     for i in range(len_):
         # ... and store it in the recently created list
-        xOut[i] = testConvIndx(wHat,yTest,i)
+        xOut[i] = testConvIndx(wHat,yTest,i,length)
     # Return list turned into a np array
     return np.array(xOut)
 
 
-def convExpandMatrix(A,wHat):
+def convExpandMatrix(A,wHat,dtype=np.float64,shape=None):
     """
     This function extends the capabilities of extendVect(yTest,wHat) to
     make it useful for matrices 
     A: image matrix to be reduced
     wHat: kernel to perform the convolution
+    dtype: data type of the extended image
+    shape: (rows,cols) of the extended image, e.g. the shape of the level A was reduced
+           from; if None it is guessed with utilities.incrDim, only right for 2^N or 2^N + 1
     returns: matrix representing the extended image
     NOTE. This function assumes the matrix A is two-dimensional
     """
     # We get number of rows and columns of given matrix A ...
     rowsA,colsA = A.shape[:2]
     # Extend the dimensions accordingly ...
-    finalRows = util.incrDim(rowsA); finalCols = util.incrDim(colsA)
+    if shape is None:
+        finalRows = util.incrDim(rowsA); finalCols = util.incrDim(colsA)
+    else:
+        finalRows,finalCols = shape[:2]
     # ... and set a matrix of zeros with the same shape
-    Afinal = np.ones((finalRows,finalCols))
+    Afinal = np.ones((finalRows,finalCols),dtype=dtype)
 
     # WE FIRST CONVOLUTE ROWS:
     for k in range(rowsA):
         # Get the row in turn and store temporarily ...
         vec_ =  np.array(A[k,:])
         # ... to convolute with kernel and store result in row of extended matrix
-        Afinal[k,:] = extendVect(vec_,wHat)
+        Afinal[k,:] = extendVect(vec_,wHat,finalCols)
     
     # Introduce an auxiliary intermediate matrix 
     Ainter = Afinal[:rowsA,:finalCols]
@@ -118,68 +140,374 @@ def convExpandMatrix(A,wHat):
         # We proceed in a similar fashion as before, this time 
         # using columns of the resulting matrix Afinal
         vec_ = np.array(Ainter[:rowsA,k])
-        Afinal[:,k] = extendVect(vec_,wHat)
+        Afinal[:,k] = extendVect(vec_,wHat,finalRows)
             
     return Afinal
 
 
-def LaplPyr3D(A,a_):
+def LaplPyr3D(A,a_,dtype=np.float64,shape=None):
     """
     This function uses the previosuly implemented function, convExpandMatrix(A,wHat),
     to apply it to a three-dimensional matrix as the ones provided by OpenCV.
     Remember that the third index in matrix A is related with BGR of the pixel (x,y)
     A: three-dimensional matrix representation of an image
     a_: Parameter that uniquely defines the kernel
+    dtype: data type of the extended image
+    shape: shape of the extended image, see convExpandMatrix
     returns: three-dimensional matrix representing reduced image
     """
-    # The kernel is defined
-    wHat = np.array([0.25 - (a_/2),0.25,a_,0.25,0.25-(a_/2)])
+    # The kernel is defined once per a_ and shared by every call
+    wHat = util.cachedKernel(a_)
    
     # Apply the "two-dimensional" function to the "B" color, index 0
-    auxL = convExpandMatrix(A[:,:,0],wHat)
+    auxL = convExpandMatrix(A[:,:,0],wHat,dtype,shape)
     
     # Get shape of resulting matrix and set a three-dimensional
     # matrix of zeros accordingly
     rows,cols = auxL.shape
-    Afin = np.zeros((rows,cols,3))
+    Afin = np.zeros((rows,cols,3),dtype=dtype)
     # Store result in the corresponding "B" color of reduced matrix
     Afin[:,:,0] = auxL
     # Repeat the same process but this time for "G" and "R" color indices
     for k in range(1,3):
-        auxL = convExpandMatrix(A[:,:,k],wHat)
+        auxL = convExpandMatrix(A[:,:,k],wHat,dtype,shape)
         Afin[:,:,k] = auxL
     return Afin
 
 
 
-def LapPyr(name,a_,size):
+def expandWeights(wHat,n,dtype=np.float64,length=None):
+    """
+    Function that precomputes the normalized weights used to expand a vector of length n.
+    Every output position only overlaps with the samples of the zero-inserted vector
+    that exist, so the kernel taps that fall outside of it are dropped and the rest
+    renormalized, as testConvIndx does
+    wHat: kernel
+    n: length of vector to be extended
+    dtype: floating point type of the weights
+    length: length of the extended vector, 2n-1 or 2n; by default the one testConvIndx
+            uses, 2n-1 for odd n and 2n for even n
+    returns: tuple (evenW, oddW); evenW has shape (3, number of even outputs) with the
+             weights of samples j-1, j, j+1 for output 2j, and oddW has shape
+             (2, number of odd outputs) with the weights of samples j, j+1 for output 2j+1
+    """
+    # Length of the zero-inserted vector, as in testConvIndx
+    if length is None:
+        len_ = 2*n - 1 if n%2 == 1 else 2*n
+    elif length in (2*n-1,2*n):
+        len_ = length
+    else:
+        raise ValueError("a vector of length %d can only be extended to %d or %d, not %d" % (n,2*n-1,2*n,length))
+    nEven = (len_+1)//2; nOdd = len_//2
+    # Flag which samples exist once the vector is padded with one zero at each end
+    valid_ = np.zeros(n+2); valid_[1:n+1] = 1.
+    evenW = np.array([wHat[0]*valid_[0:nEven], wHat[2]*valid_[1:nEven+1], wHat[4]*valid_[2:nEven+2]])
+    oddW = np.array([wHat[1]*valid_[1:nOdd+1], wHat[3]*valid_[2:nOdd+2]])
+    # Normalize the weights of every output position
+    return (evenW/evenW.sum(axis=0)).astype(dtype), (oddW/oddW.sum(axis=0)).astype(dtype)
+
+
+def expandAxis(A,wHat,axis=0,roundInterior=True,dtype=np.float64,length=None,workers=None):
+    """
+    Vectorized version of extendVect(yTest,wHat) that expands every line of an array
+    along the given axis at once. The zero insertion is never materialized: the even
+    and odd outputs are the two phases of the 5-tap filter, computed from shifted
+    slices of the input with the weights given by expandWeights(wHat,n)
+    A: array to be extended; any number of dimensions
+    wHat: kernel vector
+    axis: axis along which the array is extended
+    roundInterior: if True, the interior entries are rounded to one decimal, as
+                   testConvIndx does; set to False to keep full precision
+    dtype: floating point type used for the computation and the result
+    length: length of the result along axis, see expandWeights
+    workers: number of threads the lines are split over; None uses utilities.setNumWorkers
+    returns: array of length 2n-1 (n odd) or 2n (n even) along axis, unless length is given
+    NOTE. testConvIndx drops the weight of any sample whose value is zero, not only
+    of the inserted zeros. Here the normalization only depends on the position, so
+    results differ from extendVect next to pixels that are exactly zero
+    """
+    util.checkFloatType(dtype)
+    X = np.moveaxis(np.asarray(A,dtype=dtype),axis,0)
+    n = X.shape[0]
+    # Normalized weights of every output position, built once per (kernel, n, length)
+    evenW,oddW = util.KERNEL_CACHE.get(('expand',tuple(wHat),n,length,np.dtype(dtype).str),
+                                       lambda: expandWeights(wHat,n,dtype,length))
+    nEven = evenW.shape[1]; nOdd = oddW.shape[1]
+    # Shape that broadcasts the weights of each position over the remaining axes
+    bShape = (-1,) + (1,)*(X.ndim-1)
+    Xout = np.empty((nEven+nOdd,) + X.shape[1:],dtype=dtype)
+
+    def expandStrip(lo,hi):
+        # Expand the lines [lo,hi) of the second axis; they are independent of the rest
+        Xs = X[:,lo:hi] if X.ndim > 1 else X
+        Xo = Xout[:,lo:hi] if X.ndim > 1 else Xout
+        # Pad the input with one zero at each end so every tap has a slice to read
+        Xpad = np.zeros((n+2,) + Xs.shape[1:],dtype=dtype); Xpad[1:n+1] = Xs
+        Xo[0::2] = (evenW[0].reshape(bShape)*Xpad[0:nEven] + evenW[1].reshape(bShape)*Xpad[1:nEven+1]
+                    + evenW[2].reshape(bShape)*Xpad[2:nEven+2])
+        Xo[1::2] = oddW[0].reshape(bShape)*Xpad[1:nOdd+1] + oddW[1].reshape(bShape)*Xpad[2:nOdd+2]
+        if roundInterior:
+            len_ = Xo.shape[0]
+            Xo[2:len_-2] = np.round(Xo[2:len_-2],1)
+
+    util.parallelStrips(expandStrip,X.shape[1] if X.ndim > 1 else 1,workers,X.size)
+    return np.moveaxis(Xout,0,axis)
+
+
+def fastLaplPyr3D(A,a_,roundInterior=True,dtype=np.float64,shape=None,workers=None):
+    """
+    Vectorized counterpart of LaplPyr3D(A,a_). Rows and columns are extended with
+    expandAxis(A,wHat,axis), so all the BGR channels are processed in the same pass
+    A: two- or three-dimensional matrix representation of an image
+    a_: Parameter that uniquely defines the kernel
+    roundInterior: see expandAxis; True reproduces LaplPyr3D
+    dtype: floating point type of the extended image; float32 halves its memory
+    shape: shape of the extended image, usually the one of the level above in the
+           pyramid; each side must be 2n-1 or 2n for a side n of A. If None, the
+           size is guessed with utilities.incrDim as LaplPyr3D does, which is only
+           right for sides of the form 2^N or 2^N + 1
+    workers: number of threads each pass is split over; None uses utilities.setNumWorkers
+    returns: matrix representing extended image
+    NOTE. With rounding on, a value that lands exactly on a rounding tie may come
+    out 0.1 apart from LaplPyr3D, since the sums are not accumulated in the same order
+    """
+    wHat = util.cachedKernel(a_)
+    rowsA,colsA = A.shape[:2]
+    # Same order as convExpandMatrix: rows are convoluted first, then columns
+    Aout = expandAxis(A,wHat,1,roundInterior,dtype,None if shape is None else shape[1],workers)
+    Aout = expandAxis(Aout,wHat,0,roundInterior,dtype,None if shape is None else shape[0],workers)
+    if shape is not None:
+        return Aout
+    # extendVect only keeps the first incrDim(n) entries of the extended vector
+    return Aout[:util.incrDim(rowsA),:util.incrDim(colsA)]
+
+
+def fastLaplBatch(S,a_,roundInterior=True,dtype=np.float64,shape=None,workers=None):
+    """
+    Batched counterpart of fastLaplPyr3D(A,a_): expands a whole stack of images of the
+    same size with one vectorized EXPAND per axis, instead of one image at a time
+    S: stack of images, of shape (N,rows,cols) or (N,rows,cols,channels)
+    a_: Parameter that uniquely defines the kernel
+    roundInterior, dtype, workers: see fastLaplPyr3D
+    shape: (rows,cols) of the expanded images; if None, guessed with utilities.incrDim
+    returns: stack of expanded images; image i is fastLaplPyr3D(S[i],a_,roundInterior,dtype,shape)
+    """
+    wHat = util.cachedKernel(a_)
+    rowsA,colsA = S.shape[1:3]
+    Sout = expandAxis(S,wHat,2,roundInterior,dtype,None if shape is None else shape[1],workers)
+    Sout = expandAxis(Sout,wHat,1,roundInterior,dtype,None if shape is None else shape[0],workers)
+    if shape is not None:
+        return Sout
+    return Sout[:,:util.incrDim(rowsA),:util.incrDim(colsA)]
+
+
+def batchLaplacePyramid(S,a_,size,roundInterior=False,dtype=np.float64,workers=None):
+    """
+    This function generates the Laplacian pyramids of a stack of images of the same size at
+    once: every level takes one fastGaussBatch, one fastLaplBatch and one subtraction for the
+    whole stack. Image i gets the levels of encodeLapPyr(S[i],a_,size,roundInterior,dtype)
+    S: stack of images, of shape (N,rows,cols) or (N,rows,cols,channels); a list of
+       images of the same shape is stacked
+    a_: parameter that defines kernel
+    size: number of Laplacian levels
+    roundInterior: see expandAxis
+    dtype: floating point type of the levels
+    workers: see fastGaussBatch
+    returns: list [G_size, L_size-1, ..., L_0] of stacks; level k of image i is [k][i]
+    """
+    GPyr = batchGaussPyramid(S,a_,size,dtype,workers)
+    Lapl = [np.asarray(GPyr[size],dtype=dtype)]
+    for k in range(size-1,-1,-1):
+        pixels_ = GPyr[k].shape[0]*pixelsOf(GPyr[k][0])
+        with stage('expand',k,pixels_):
+            expanded_ = fastLaplBatch(GPyr[k+1],a_,roundInterior,dtype,GPyr[k].shape[1:3],workers)
+        with stage('subtract',k,pixels_):
+            Lapl.append(np.subtract(GPyr[k],expanded_,out=expanded_,dtype=dtype))
+    return Lapl
+
+
+def laplaceBand(A,expanded,dtype=np.float64,laplDtype=None):
+    """
+    Function that gives a Laplacian level, the difference between a Gaussian level and its prediction
+    A: Gaussian level (or rows of it)
+    expanded: EXPAND of the next Gaussian level (or the same rows of it)
+    dtype: floating point type the difference is computed in
+    laplDtype: data type of the result, dtype if None. Integer types (e.g. np.int16)
+               get the difference rounded to the nearest integer, not truncated
+    returns: Laplacian level
+    """
+    diff_ = np.subtract(A,expanded,dtype=dtype)
+    if laplDtype is None:
+        return diff_
+    if np.issubdtype(laplDtype,np.integer):
+        diff_ = np.rint(diff_,out=diff_)
+    return diff_.astype(laplDtype,copy=False)
+
+
+def fusedLaplaceLevel(A,reduce_,expand_,subtract_=None,strip_rows=32,gauss=None,laplace=None,level=None):
+    """
+    This function computes the next Gaussian level G1 = REDUCE(A) and the Laplacian level
+    L = A - EXPAND(G1) in a single sweep over A. A is walked in horizontal strips: every
+    strip of G1 is reduced from rows of A (plus a halo) and, while those rows are still in
+    cache, the rows of L that the strips of G1 computed so far determine are expanded and
+    subtracted. No full-size EXPAND or difference is ever materialized
+    A: array-like image (e.g. a level, or a np.memmap)
+    reduce_: function that reduces a whole image, e.g. pyramid.Pyramid.reduceLevel
+    expand_: function that expands a whole image to a shape, e.g. pyramid.Pyramid.expandLevel
+    subtract_: function of (rows of A, their prediction) that gives the rows of L; by default
+               their difference
+    strip_rows: number of rows of G1 computed at a time
+    gauss, laplace: optional preallocated outputs (e.g. memory-mapped levels); by default
+                    they are allocated with the type of the first strip
+    level: level of A in its pyramid, used to label the reduce, expand and subtract stages
+           recorded for every strip (see profiling.stage)
+    returns: tuple (G1, L)
+    NOTE. The result is the one of expanding and subtracting whole levels: as in
+    tiled.py, the rows kept from every strip are never at its (artificial) edges
+    """
+    if subtract_ is None:
+        subtract_ = lambda a,b: a - b
+    n = A.shape[0]
+    m = (n+1)//2
+    cols_ = (A.shape[1]+1)//2
+    # Rows of L already computed
+    done_ = 0
+    for r0 in range(0,m,strip_rows):
+        r1 = min(r0+strip_rows,m)
+        with stage('reduce',None if level is None else level+1,(r1-r0)*cols_):
+            strip_ = util.reduceRegion(A,(r0,r1),(0,cols_),reduce_)
+            if gauss is None:
+                gauss = np.empty((m,) + strip_.shape[1:],dtype=strip_.dtype)
+            gauss[r0:r1] = strip_
+        # Row x of L needs rows x//2-1,...,x//2+1 of G1 plus a halo (see utilities.expandWindow),
+        # so rows up to 2*r1-5 only depend on rows of G1 already computed
+        x1 = n if r1 == m else max(min(2*r1-5,n),done_)
+        if x1 > done_:
+            with stage('expand',level,(x1-done_)*A.shape[1]):
+                expanded_ = util.expandRegion(gauss,(done_,x1),(0,A.shape[1]),A.shape,expand_)
+            with stage('subtract',level,(x1-done_)*A.shape[1]):
+                band_ = subtract_(np.asarray(A[done_:x1]),expanded_)
+                if laplace is None:
+                    laplace = np.empty(A.shape[:1] + band_.shape[1:],dtype=band_.dtype)
+                laplace[done_:x1] = band_
+            done_ = x1
+    return gauss,laplace
+
+
+def LapPyr(name,a_,size,fast=False,dtype=np.float64,laplDtype=None):
     """
-    This function generates a Laplacian pyramid of an image accesed by the name of file containing it
-    name: name of file containing image
+    This function generates a Laplacian pyramid of an image accesed by the name of file containing it,
+    or given as a matrix
+    name: name of file containing image, or its matrix
     a_: parameter that defines kernel
     size: size of pyramid; number of levels in pyramid
+    fast: if True the vectorized fastGaussPyr3D and fastLaplPyr3D are used, and each
+          Laplacian level is computed with the next Gaussian one by fusedLaplaceLevel.
+          On both paths each level is expanded to the shape of the level above, so any
+          image size works
+    dtype: floating point type of the Gaussian levels, in which the Laplacian levels are computed
+    laplDtype: data type of the Laplacian levels, dtype if None; see laplaceBand.
+               np.int16 gives signed bands rounded to integers
+    """
+    util.checkFloatType(dtype)
+    if fast:
+        subtract_ = lambda A,expanded: laplaceBand(A,expanded,dtype,laplDtype)
+        # Every Laplacian level and the next Gaussian level are computed in one sweep
+        A = util.readImage(name)
+        Lapl = []
+        for k in range(size+1):
+            with stage('fused',k,pixelsOf(A)):
+                A,aux_ = fusedLaplaceLevel(A,lambda X: fastGaussPyr3D(X,a_,dtype),
+                                           lambda X,shape: fastLaplPyr3D(X,a_,dtype=dtype,shape=shape),
+                                           subtract_,level=k)
+            Lapl.append(aux_)
+        return Lapl[::-1]
+    return list(iterLapPyr(name,a_,size,dtype,laplDtype))
+
+
+def iterLapPyr(name,a_,size,dtype=np.float64,laplDtype=None):
     """
+    This function generates the levels of LapPyr(name,a_,size,False,dtype,laplDtype) one at a time,
+    coarsest first, so each level can be used (e.g. encoded) while the next one is computed
+    name, a_, size, dtype, laplDtype: see LapPyr
+    returns: generator of the Laplacian levels
+    """
+    util.checkFloatType(dtype)
     # Get gaussian pyramid
-    GPyr = MatrixGaussPyramid(name,a_,size+1)
-    # Initialize list that will contain laplacian pyramid as an empty list
-    Lapl = []
+    GPyr = MatrixGaussPyramid(name,a_,size+1,False,dtype)
     # Loop over all levels in pyramid...
     for k in range(size+1,0,-1):
         # ... and get the level in turn as the difference between two consecutive Gaussian pyramids ...
-        aux_ = GPyr[k-1] - LaplPyr3D(GPyr[k],a_)
-        # ... and append it to the list 
-        Lapl.append(aux_)
+        with stage('expand',k-1,pixelsOf(GPyr[k-1])):
+            expanded_ = LaplPyr3D(GPyr[k],a_,dtype,GPyr[k-1].shape)
+        with stage('subtract',k-1,pixelsOf(GPyr[k-1])):
+            aux_ = laplaceBand(GPyr[k-1],expanded_,dtype,laplDtype)
+        # ... and hand it over
+        yield aux_
+
+
+
+def encodeLapPyr(A,a_,size,roundInterior=False,dtype=np.float64):
+    """
+    This function generates the Laplacian pyramid of a matrix so that it can be
+    reconstructed exactly by reconstructLapPyr. Unlike LapPyr, exactly size REDUCE
+    steps are taken and the deepest Gaussian level is kept as the residual. Every
+    level is expanded to the shape of the level above it, so any size works
+    A: matrix representation of an image
+    a_: parameter that defines kernel
+    size: number of Laplacian levels
+    roundInterior: see expandAxis; both functions must use the same value
+    dtype: floating point type of the levels
+    returns: list [G_size, L_size-1, ..., L_0], as Pyramid.laplacePyramid
+    """
+    GPyr = [A]
+    for k in range(size):
+        GPyr.append(fastGaussPyr3D(GPyr[-1],a_,dtype))
+    Lapl = [np.asarray(GPyr[size],dtype=dtype)]
+    for k in range(size-1,-1,-1):
+        expanded_ = fastLaplPyr3D(GPyr[k+1],a_,roundInterior,dtype,GPyr[k].shape)
+        Lapl.append(np.subtract(GPyr[k],expanded_,dtype=dtype))
     return Lapl
 
 
+def reconstructLapPyr(Lapl,a_,roundInterior=False,dtype=np.float64,out=None):
+    """
+    This function collapses a Laplacian pyramid back into an image, G_k = L_k + EXPAND(G_k+1).
+    The shape of each level is taken from the band itself, so odd sizes round-trip exactly.
+    All levels are accumulated in a single buffer of the size of the image: level k lives
+    in its top-left corner while the next, larger level is computed
+    Lapl: list [G_size, L_size-1, ..., L_0] as returned by encodeLapPyr
+    a_: parameter that defines kernel
+    roundInterior: see expandAxis; must be the value used to encode the pyramid
+    dtype: floating point type of the accumulator
+    out: optional preallocated accumulator with the shape of L_0
+    returns: reconstructed image (the accumulator)
+    """
+    if out is None:
+        out = np.empty(Lapl[-1].shape,dtype=dtype)
+    rows_,cols_ = Lapl[0].shape[:2]
+    out[:rows_,:cols_] = Lapl[0]
+    for item in Lapl[1:]:
+        expanded_ = fastLaplPyr3D(out[:rows_,:cols_],a_,roundInterior,dtype,item.shape)
+        rows_,cols_ = item.shape[:2]
+        np.add(expanded_,item,out=out[:rows_,:cols_],casting='unsafe')
+    return out
+
 
-def ImagesLaplPyramid(name,size):
+def ImagesLaplPyramid(name,size,writer=None):
+    """
+    This function writes to file the levels of the Laplacian pyramid of an image
+    name: name of file containing image, or its matrix
+    size: size of pyramid; number of levels in pyramid
+    writer: optional image_writer.ImageWriter (e.g. to choose the format); by default
+            one is created. Each level is encoded in the background while the next one
+            is expanded, and all of them are on disk when the function returns
+    NOTE. LapPyr(A,0.4,size) returns the same levels without writing them
+    """
     # Set parameter for kernel
     a_ = 0.4
-    # Generate the list containing Laplacian pyramid...
-    lapPyr = LapPyr(name,a_,size)
-    # ... and save each imagein list to file 
-    for k in range(len(lapPyr)):
-        name_ = 'Laplace_0' + str(k) + '.jpg'
-        print name_
-        cv2.imwrite(name_,lapPyr[k])
+    # Generate the Laplacian levels one at a time...
+    lapPyr = iterLapPyr(name,a_,size)
+    # ... and save each image to file as soon as it is computed
+    for name_ in writeAll(writer,(('Laplace_0' + str(k) + '.jpg',level_) for k,level_ in enumerate(lapPyr))):
+        print(name_)
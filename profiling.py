@@ -0,0 +1,194 @@
+from __future__ import print_function
+import json
+import os
+import threading
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+"""
+This module is an opt-in instrumentation layer. The pyramid and blending
+functions mark their stages (decode, reduce, expand, subtract, stitch, blend,
+collapse, encode) with `stage(name,level,pixels)`; while a Profiler is active,
+every stage records its wall time, the pixels it produced and, optionally, the
+bytes it allocated. With no active Profiler a stage is a shared do-nothing object
+
+    with Profiler() as prof:
+        blendImages('apple.jpg','orange.jpg','blend.jpg',4)
+    prof.printReport()
+    prof.writeChromeTrace('blend_trace.json')
+"""
+
+_clock = getattr(time,'perf_counter',time.time)
+# Profiler receiving the stages; None when profiling is disabled
+_active = None
+
+
+class _NullStage(object):
+    # Stage used when profiling is disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    __slots__ = ('profiler','name','level','pixels','start','memory')
+
+    def __init__(self,profiler,name,level,pixels):
+        self.profiler = profiler; self.name = name; self.level = level; self.pixels = pixels
+
+    def __enter__(self):
+        self.memory = tracemalloc.get_traced_memory()[0] if self.profiler.trace_memory else None
+        self.start = _clock()
+        return self
+
+    def __exit__(self,exc_type,exc_value,tb):
+        end_ = _clock()
+        bytes_ = None
+        if self.memory is not None:
+            bytes_ = tracemalloc.get_traced_memory()[0] - self.memory
+        self.profiler._record({'stage': self.name, 'level': self.level, 'start': self.start,
+                               'seconds': end_ - self.start, 'pixels': self.pixels,
+                               'bytes': bytes_, 'thread': threading.current_thread().name})
+        return False
+
+
+def stage(name,level=None,pixels=None):
+    """
+    Function that marks a stage of the computation, used as `with stage('reduce',k,pixels):`
+    name: name of the stage
+    level: level of the pyramid the stage works on, if any
+    pixels: number of pixels (rows*cols) the stage produces, used for the throughput
+    returns: context manager that records the stage if a Profiler is active
+    """
+    profiler_ = _active
+    if profiler_ is None:
+        return _NULL_STAGE
+    return _Stage(profiler_,name,level,pixels)
+
+
+def pixelsOf(A):
+    # Number of pixels of an image, for stage()
+    return A.shape[0]*A.shape[1] if A is not None and A.ndim >= 2 else None
+
+
+def reducedPixels(A):
+    # Number of pixels of the REDUCE of an image, for stage()
+    return ((A.shape[0]+1)//2)*((A.shape[1]+1)//2)
+
+
+class Profiler(object):
+    """
+    Collector of the stages run while it is active. Only one Profiler is active at a time;
+    stages run by other threads (e.g. the background image writer) are recorded as well
+    """
+
+    def __init__(self,callback=None,trace_memory=False):
+        """
+        callback: optional function called with every stage recorded, a dictionary with the
+                  entries stage, level, start, seconds, pixels, bytes and thread
+        trace_memory: if True the net bytes allocated by every stage are measured with
+                      tracemalloc, which slows the computation down noticeably
+        """
+        if trace_memory and tracemalloc is None:
+            raise ValueError("tracemalloc is not available, memory cannot be traced")
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.events = []
+        self._lock = threading.Lock()
+        self._previous = None
+        self._started = False
+
+    def _record(self,event):
+        with self._lock:
+            self.events.append(event)
+        if self.callback is not None:
+            self.callback(event)
+
+    def start(self):
+        global _active
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+        self._previous,_active = _active,self
+        return self
+
+    def stop(self):
+        global _active
+        _active = self._previous
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self,exc_type,exc_value,tb):
+        self.stop()
+        return False
+
+    def report(self):
+        """
+        Function that aggregates the stages recorded by name and level
+        returns: list of dictionaries with the entries stage, level, calls, seconds, pixels,
+                 bytes and mpix_per_s (megapixels per second), the slowest first.
+                 pixels and bytes are None if no stage of the group recorded them
+        """
+        groups_ = {}
+        with self._lock:
+            events_ = list(self.events)
+        for event_ in events_:
+            key_ = (event_['stage'],event_['level'])
+            row_ = groups_.setdefault(key_,{'stage': key_[0], 'level': key_[1], 'calls': 0,
+                                            'seconds': 0., 'pixels': None, 'bytes': None})
+            row_['calls'] += 1
+            row_['seconds'] += event_['seconds']
+            for field_ in ('pixels','bytes'):
+                if event_[field_] is not None:
+                    row_[field_] = (row_[field_] or 0) + event_[field_]
+        rows_ = sorted(groups_.values(),key=lambda r: -r['seconds'])
+        for row_ in rows_:
+            row_['mpix_per_s'] = (row_['pixels']/row_['seconds']/1e6
+                                  if row_['pixels'] and row_['seconds'] > 0 else None)
+        return rows_
+
+    def printReport(self):
+        """
+        Function that shows on screen the aggregated stages, as given by report
+        """
+        print('%-10s %5s %6s %10s %12s %12s' % ('stage','level','calls','ms','Mpix/s','bytes'))
+        for row_ in self.report():
+            print('%-10s %5s %6d %10.3f %12s %12s' % (row_['stage'],'' if row_['level'] is None else row_['level'],
+                  row_['calls'],1e3*row_['seconds'],
+                  '' if row_['mpix_per_s'] is None else '%.1f' % row_['mpix_per_s'],
+                  '' if row_['bytes'] is None else row_['bytes']))
+
+    def writeChromeTrace(self,name):
+        """
+        Function that writes the stages recorded in the Trace Event format, which is
+        opened by chrome://tracing or https://ui.perfetto.dev
+        name: name of the JSON file
+        """
+        with self._lock:
+            events_ = list(self.events)
+        origin_ = min([e['start'] for e in events_] or [0.])
+        threads_ = {}
+        trace_ = []
+        for event_ in events_:
+            args_ = dict((k,event_[k]) for k in ('level','pixels','bytes') if event_[k] is not None)
+            trace_.append({'name': event_['stage'], 'cat': 'pyramid', 'ph': 'X',
+                           'ts': 1e6*(event_['start'] - origin_), 'dur': 1e6*event_['seconds'],
+                           'pid': os.getpid(), 'tid': threads_.setdefault(event_['thread'],len(threads_)),
+                           'args': args_})
+        for thread_,tid_ in threads_.items():
+            trace_.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid_,
+                           'args': {'name': thread_}})
+        with open(name,'w') as f:
+            json.dump({'traceEvents': trace_, 'displayTimeUnit': 'ms'},f)
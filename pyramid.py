@@ -0,0 +1,170 @@
+import cv2
+import numpy as np
+import utilities as util
+from profiling import stage, pixelsOf, reducedPixels
+from gauss_pyramid import fastGaussPyr3D
+from laplace_pyramid import fastLaplPyr3D, fusedLaplaceLevel, laplaceBand
+
+"""
+This module contains the Pyramid class, which holds the Gaussian and Laplacian
+levels of one image. Levels are computed lazily, one at a time, and kept so that
+every consumer (Gaussian sequences, Laplacian pyramids, blending) shares them
+"""
+
+# Data types of the (Gaussian levels, Laplacian levels) for each precision policy.
+# 'legacy' keeps the types each method produces: float64 for the from-scratch
+# path and uint8, with saturating subtraction, for OpenCV
+PRECISIONS = {'legacy': (None,None),
+              'float32': (np.float32,np.float32),
+              'int16': (np.float32,np.int16)}
+
+
+class Pyramid(object):
+    """
+    Gaussian/Laplacian pyramid of an image with lazy, memoized levels.
+    Level 0 is the original image; level k+1 is REDUCE of level k. The Laplacian
+    level k is the difference between Gaussian level k and the EXPAND of level k+1
+    """
+
+    def __init__(self,image,a_=0.4,method='scratch',precision='legacy',strip_rows=32):
+        """
+        image: matrix representation of the image (level 0 of the pyramid)
+        a_: parameter that determines kernel; only used by the from-scratch method
+        method: 'scratch' for the vectorized from-scratch REDUCE/EXPAND, or 'opencv'
+                for cv2.pyrDown/cv2.pyrUp and the saturating cv2.subtract
+        precision: data types of the levels; one of PRECISIONS. 'float32' stores
+                   float32 Gaussian and Laplacian levels, 'int16' float32 Gaussian
+                   levels and Laplacian levels rounded to signed int16. Both keep
+                   the negative Laplacian detail that uint8 saturation clips.
+                   Level 0 is always kept as given
+        strip_rows: when a Laplacian level k is requested before Gaussian level k+1
+                    exists, both are computed in one sweep over level k, strip_rows rows
+                    of level k+1 at a time (see fusedLaplaceLevel); None computes the
+                    whole REDUCE, EXPAND and subtraction one after another
+        """
+        if method not in ('scratch','opencv'):
+            raise ValueError("method must be 'scratch' or 'opencv', got %r" % (method,))
+        if precision not in PRECISIONS:
+            raise ValueError("precision must be one of %s, got %r" % (sorted(PRECISIONS),precision))
+        self.a_ = a_
+        self.method = method
+        self.precision = precision
+        self.gaussDtype,self.laplaceDtype = PRECISIONS[precision]
+        self.strip_rows = strip_rows
+        # Gaussian levels computed so far, finest first
+        self._gauss = [image]
+        # EXPAND of Gaussian level k+1 and Laplacian level k, keyed by k
+        self._expanded = {}
+        self._laplace = {}
+
+    @classmethod
+    def fromFile(cls,name,a_=0.4,method='scratch',precision='legacy'):
+        """
+        Function that creates the pyramid of the image contained in a file
+        name: name of file containing image (a matrix is used as is)
+        a_, method, precision: see Pyramid.__init__
+        """
+        return cls(util.readImage(name),a_,method,precision)
+
+    def __len__(self):
+        # Number of Gaussian levels computed so far
+        return len(self._gauss)
+
+    def reduceLevel(self,A):
+        """
+        Function that applies the REDUCE of this pyramid to any image, e.g. to a part of a level
+        A: image at the size of some level k
+        returns: reduced image
+        """
+        if self.method == 'opencv':
+            if self.gaussDtype is not None:
+                A = A.astype(self.gaussDtype,copy=False)
+            return cv2.pyrDown(A)
+        return fastGaussPyr3D(A,self.a_,self.gaussDtype or np.float64)
+
+    def expandLevel(self,A,shape):
+        """
+        Function that applies the EXPAND of this pyramid to any image, e.g. while collapsing
+        A: image at the size of some level k+1
+        shape: shape of level k
+        returns: expanded image
+        """
+        if self.method == 'opencv':
+            return cv2.pyrUp(A,dstsize=(shape[1],shape[0]))
+        return fastLaplPyr3D(A,self.a_,dtype=self.gaussDtype or np.float64,shape=shape)
+
+    def extend(self,levels):
+        """
+        Function that makes sure the Gaussian levels 0,...,levels are computed.
+        Levels computed earlier are reused, never recomputed
+        levels: deepest level needed
+        returns: the pyramid itself
+        """
+        while len(self._gauss) <= levels:
+            with stage('reduce',len(self._gauss),reducedPixels(self._gauss[-1])):
+                self._gauss.append(self.reduceLevel(self._gauss[-1]))
+        return self
+
+    def gauss(self,k):
+        """
+        Function that returns the kth level of the Gaussian pyramid
+        k: level; 0 is the original image
+        """
+        return self.extend(k)._gauss[k]
+
+    def expanded(self,k):
+        """
+        Function that returns the EXPAND of Gaussian level k+1, the prediction of level k
+        k: level whose prediction is requested
+        """
+        if k not in self._expanded:
+            shape_ = self.gauss(k).shape; level_ = self.gauss(k+1)
+            with stage('expand',k,shape_[0]*shape_[1]):
+                self._expanded[k] = self.expandLevel(level_,shape_)
+        return self._expanded[k]
+
+    def laplace(self,k):
+        """
+        Function that returns the kth level of the Laplacian pyramid
+        k: level; 0 has the size of the original image
+        """
+        if k not in self._laplace:
+            gauss_ = self.gauss(k)
+            if self.strip_rows and len(self._gauss) == k+1:
+                # Level k+1 does not exist yet: compute it and this level in a single sweep,
+                # without materializing the EXPAND
+                with stage('fused',k,pixelsOf(gauss_)):
+                    gauss1_,self._laplace[k] = fusedLaplaceLevel(gauss_,self.reduceLevel,self.expandLevel,
+                                                                 self._subtract,self.strip_rows,level=k)
+                self._gauss.append(gauss1_)
+            else:
+                expanded_ = self.expanded(k)
+                with stage('subtract',k,pixelsOf(gauss_)):
+                    self._laplace[k] = self._subtract(gauss_,expanded_)
+        return self._laplace[k]
+
+    def _subtract(self,gauss_,expanded_):
+        # Laplacian level from a Gaussian level and its prediction, in the types of the precision
+        if self.laplaceDtype is not None:
+            return laplaceBand(gauss_,expanded_,self.gaussDtype,self.laplaceDtype)
+        if self.method == 'opencv':
+            return cv2.subtract(gauss_,expanded_)
+        return gauss_ - expanded_
+
+    def gaussPyramid(self,size):
+        """
+        Function that returns the Gaussian pyramid as a list, finest level first
+        size: number of times the image is reduced
+        returns: list with the levels 0,...,size, same layout as get_GaussPyrimid
+        """
+        return [self.gauss(k) for k in range(size+1)]
+
+    def laplacePyramid(self,size):
+        """
+        Function that returns the Laplacian pyramid as a list, coarsest level first
+        size: number of Laplacian levels
+        returns: list [G_size, L_size-1, ..., L_0], same layout as get_LaplacePyramid
+        """
+        # Finest level first, so every Laplacian level is fused with the next REDUCE
+        Lapl = [self.laplace(k) for k in range(size)]
+        return [self.gauss(size)] + Lapl[::-1]
@@ -0,0 +1,86 @@
+import json
+import struct
+import numpy as np
+
+"""
+This module stores a whole pyramid in a single file. All the levels are packed,
+without any loss, in one contiguous buffer that follows a small header with the
+shape, data type and position of every level and the kernel parameter a_. The
+file is reopened with np.memmap, so any level is read lazily and without copies.
+
+Layout of the file:
+    MAGIC (8 bytes), header length n (uint32, little endian), header (n bytes of
+    JSON), then the buffer, at the next multiple of ALIGN, with every level in C
+    order, each one starting at a multiple of ALIGN
+"""
+
+MAGIC = b'PYRAMID1'
+# Levels start at multiples of this number of bytes, so every view is aligned
+ALIGN = 64
+
+
+def _aligned(n):
+    return (n + ALIGN - 1)//ALIGN*ALIGN
+
+
+def writePyramid(name,levels,a_=None,kind='laplace'):
+    """
+    Function that writes a pyramid to a single file
+    name: name of file
+    levels: list of matrices, e.g. Pyramid.laplacePyramid(size) or Pyramid.gaussPyramid(size);
+            any shapes and data types (signed Laplacian levels are kept as they are)
+    a_: parameter of the kernel the pyramid was built with, stored in the header
+    kind: description of the list of levels, e.g. 'laplace' for [G_size, L_size-1, ..., L_0]
+          or 'gauss' for [G_0, ..., G_size]; stored in the header
+    """
+    levels = [np.asarray(level_) for level_ in levels]
+    # Offsets are counted from the start of the buffer, right after the header
+    entries_ = []; offset_ = 0
+    for level_ in levels:
+        entries_.append({'shape': list(level_.shape), 'dtype': level_.dtype.str, 'offset': offset_})
+        offset_ = _aligned(offset_ + level_.nbytes)
+    text_ = json.dumps({'a_': a_, 'kind': kind, 'levels': entries_}).encode('ascii')
+    start_ = _aligned(len(MAGIC) + 4 + len(text_))
+    with open(name,'wb') as f:
+        f.write(MAGIC + struct.pack('<I',len(text_)) + text_)
+        for entry_,level_ in zip(entries_,levels):
+            f.seek(start_ + entry_['offset'])
+            np.ascontiguousarray(level_).tofile(f)
+        # Make the file long enough for the padding of the last level
+        f.truncate(start_ + offset_)
+
+
+def readHeader(name):
+    """
+    Function that reads the header of a pyramid file
+    name: name of file written by writePyramid
+    returns: dictionary with the entries 'a_', 'kind', 'levels' (shape, dtype and offset of
+             each level, from the start of the buffer) and 'start' (position of the buffer)
+    """
+    with open(name,'rb') as f:
+        magic_ = f.read(len(MAGIC))
+        if magic_ != MAGIC:
+            raise ValueError("%r is not a pyramid file" % (name,))
+        n_, = struct.unpack('<I',f.read(4))
+        header_ = json.loads(f.read(n_).decode('ascii'))
+    header_['start'] = _aligned(len(MAGIC) + 4 + n_)
+    return header_
+
+
+def readPyramid(name,mode='r'):
+    """
+    Function that reopens a pyramid written by writePyramid without reading its levels
+    name: name of file
+    mode: mode of np.memmap; 'r' for read only, 'r+' to modify the levels in place,
+          'c' for copy-on-write
+    returns: tuple (levels, header). levels is a list of views of a single np.memmap of the
+             file, in the order they were written; their data are only read when accessed
+    """
+    header_ = readHeader(name)
+    buffer_ = np.memmap(name,dtype=np.uint8,mode=mode,offset=header_['start'])
+    levels = []
+    for entry_ in header_['levels']:
+        dtype_ = np.dtype(entry_['dtype']); shape_ = tuple(entry_['shape'])
+        nbytes_ = int(np.prod(shape_))*dtype_.itemsize
+        levels.append(buffer_[entry_['offset']:entry_['offset']+nbytes_].view(dtype_).reshape(shape_))
+    return levels,header_
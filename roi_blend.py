@@ -0,0 +1,146 @@
+import numpy as np
+from pyramid import Pyramid
+from from_openCV import readMask, toImage
+from utilities import reduceRegion, expandRegion
+
+"""
+This module re-blends two images after the blending mask is edited in a
+rectangle, recomputing only what the edit changes. The pyramids of both images
+are kept, and so are the pyramid of the mask and every level of the collapse;
+the dirty rectangle grows by the support of the kernel from level to level, so
+an edit costs in proportion to the area it touches instead of the whole image
+"""
+
+
+def reducedRect(rect,shape):
+    """
+    Function that gives the rectangle of the REDUCE of an image that changes when a rectangle
+    of the image does
+    rect: (r0,r1,c0,c1), first and one past the last row and column that changed
+    shape: shape of the reduced image
+    returns: rectangle (r0,r1,c0,c1) of the reduced image that changes
+    """
+    # Entry i of the reduced image depends on samples 2i-2,...,2i+2
+    r0,r1,c0,c1 = rect
+    return (max((r0-1)//2,0),min((r1+1)//2+1,shape[0]),
+            max((c0-1)//2,0),min((c1+1)//2+1,shape[1]))
+
+
+def expandedRect(rect,shape):
+    """
+    Function that gives the rectangle of the EXPAND of an image that changes when a rectangle
+    of the image does
+    rect: (r0,r1,c0,c1), first and one past the last row and column that changed
+    shape: shape of the expanded image
+    returns: rectangle (r0,r1,c0,c1) of the expanded image that changes
+    """
+    # Entry x of the expanded image depends on samples x//2-1,...,x//2+1
+    r0,r1,c0,c1 = rect
+    return (max(2*r0-2,0),min(2*r1+2,shape[0]),max(2*c0-2,0),min(2*c1+2,shape[1]))
+
+
+def unionRect(a,b):
+    # Smallest rectangle that contains both rectangles; either one may be None
+    if a is None or b is None:
+        return a if b is None else b
+    return (min(a[0],b[0]),max(a[1],b[1]),min(a[2],b[2]),max(a[3],b[3]))
+
+
+class RegionBlend(object):
+    """
+    Blend of two images with a soft mask that can be edited incrementally. The result
+    is the one of from_openCV.blendPyramidsMask; after update() only the rectangles of
+    the mask pyramid, the blended levels and the collapse that the edit reaches are
+    recomputed. Every level of the collapse is kept, as float32
+    """
+
+    def __init__(self,pyrA,pyrB,mask,size):
+        """
+        pyrA, pyrB: Pyramid objects of the images to be blended; their levels are cached
+        mask: soft mask with the weights of the first image, see from_openCV.readMask
+        size: size of pyramids (number of levels in pyramids) used to do the blending
+        """
+        self.pyrA = pyrA; self.pyrB = pyrB; self.size = size
+        shape_ = pyrA.gauss(0).shape
+        self._pyrM = Pyramid(readMask(mask,shape_),pyrA.a_,pyrA.method)
+        # Levels of the mask pyramid, edited in place by update()
+        self._mask = [np.array(self._pyrM.gauss(k)) for k in range(size+1)]
+        # Level k of the collapse, R_k = blend of level k + EXPAND(R_k+1)
+        self._result = [np.empty(pyrA.gauss(k).shape,dtype=np.float32) for k in range(size+1)]
+        self._collapse([(0,m.shape[0],0,m.shape[1]) for m in self._mask])
+
+    def _bands(self,k):
+        # Level k of the Laplacian pyramids of both images; the deepest one is Gaussian
+        if k == self.size:
+            return self.pyrA.gauss(k),self.pyrB.gauss(k)
+        return self.pyrA.laplace(k),self.pyrB.laplace(k)
+
+    def _blendRect(self,k,rect):
+        # Level k of the blend, M*LA + (1-M)*LB, in a rectangle
+        r0,r1,c0,c1 = rect
+        la,lb = self._bands(k)
+        la = la[r0:r1,c0:c1]; lb = lb[r0:r1,c0:c1]
+        mk_ = self._mask[k][r0:r1,c0:c1]
+        if la.ndim == 3:
+            mk_ = mk_[:,:,None]
+        level_ = np.subtract(la,lb,dtype=np.float32)
+        np.multiply(level_,mk_,out=level_)
+        np.add(level_,lb,out=level_,casting='unsafe')
+        return level_
+
+    def _collapse(self,dirty):
+        """
+        Function that recomputes the collapse from the rectangles of each level whose mask changed
+        dirty: list with the rectangle (r0,r1,c0,c1) of every level, finest first, or None
+        returns: rectangle of the result that changed
+        """
+        changed_ = None
+        for k in range(self.size,-1,-1):
+            shape_ = self._result[k].shape
+            if changed_ is not None:
+                changed_ = expandedRect(changed_,shape_)
+            rect_ = unionRect(dirty[k],changed_)
+            if rect_ is None:
+                continue
+            r0,r1,c0,c1 = rect_
+            level_ = self._blendRect(k,rect_)
+            if k < self.size:
+                np.add(level_,expandRegion(self._result[k+1],(r0,r1),(c0,c1),shape_,self.pyrA.expandLevel),
+                       out=level_,casting='unsafe')
+            self._result[k][r0:r1,c0:c1] = level_
+            changed_ = rect_
+        return changed_
+
+    def update(self,rect,values):
+        """
+        Function that changes the mask in a rectangle and updates the blend
+        rect: (r0,r1,c0,c1), first and one past the last row and column of the mask edited
+        values: new weights of the first image in the rectangle, as accepted by
+                from_openCV.readMask (e.g. a float matrix in [0,1] of the size of rect)
+        returns: rectangle (r0,r1,c0,c1) of the result that changed
+        """
+        r0,r1,c0,c1 = rect
+        self._mask[0][r0:r1,c0:c1] = readMask(values,(r1-r0,c1-c0))
+        # The edit reaches a slightly larger rectangle at every level of the mask pyramid
+        dirty = [tuple(rect)]
+        for k in range(1,self.size+1):
+            rect_ = reducedRect(dirty[-1],self._mask[k].shape)
+            self._mask[k][rect_[0]:rect_[1],rect_[2]:rect_[3]] = reduceRegion(
+                self._mask[k-1],rect_[:2],rect_[2:],self._pyrM.reduceLevel)
+            dirty.append(rect_)
+        return self._collapse(dirty)
+
+    def mask(self):
+        # Current mask, at the size of the images
+        return self._mask[0]
+
+    def result(self):
+        """
+        Function that returns the current blend
+        returns: float32 blended image; it is updated in place by update()
+        """
+        return self._result[0]
+
+    def image(self):
+        # Current blend as a uint8 image
+        return toImage(self._result[0])
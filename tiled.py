@@ -0,0 +1,195 @@
+import os
+import shutil
+import tempfile
+import cv2
+import numpy as np
+from gauss_pyramid import fastGaussPyr3D
+from laplace_pyramid import fastLaplPyr3D, fusedLaplaceLevel
+from from_openCV import stitchHalves
+from utilities import reduceRegion, expandRegion
+
+"""
+This module builds pyramids and blends of images that do not fit in memory.
+Images are read from memory-mapped .npy files in horizontal strips, each one
+with a halo of rows wide enough for the 5-tap kernel, and every level is
+written to a memory-mapped .npy file. Peak memory is bounded by the size of
+a strip instead of the size of the image
+"""
+
+
+def openImage(src):
+    """
+    Function that gives access to an image without loading it in memory
+    src: name of a .npy file, or an array (e.g. a np.memmap) that is used as is
+    returns: array-like indexed by rows
+    """
+    if isinstance(src,str):
+        return np.load(src,mmap_mode='r')
+    return src
+
+
+def createLevel(name,shape,dtype):
+    """
+    Function that creates a memory-mapped .npy file to store a level
+    name: name of file
+    shape, dtype: shape and data type of the level
+    returns: writable np.memmap
+    """
+    return np.lib.format.open_memmap(name,mode='w+',dtype=dtype,shape=tuple(shape))
+
+
+def reduceStrip(A,method,a_,dtype=np.float32):
+    """
+    Function that reduces a strip of rows as if it were a whole image
+    A: strip of rows
+    method: 'scratch' for fastGaussPyr3D or 'opencv' for cv2.pyrDown
+    a_: parameter that determines kernel
+    dtype: floating point type the strip is reduced in
+    """
+    if method == 'opencv':
+        # Cast before reducing, so uint8 strips are not rounded by cv2.pyrDown
+        return cv2.pyrDown(np.asarray(A,dtype=dtype))
+    return fastGaussPyr3D(A,a_,dtype)
+
+
+def expandStrip(A,shape,method,a_,dtype=np.float32):
+    """
+    Function that expands a strip of rows as if it were a whole image
+    A: strip of rows
+    shape: (rows,cols) of the expanded strip
+    method: 'scratch' for the vectorized from-scratch EXPAND or 'opencv' for cv2.pyrUp
+    a_: parameter that determines kernel
+    dtype: floating point type the strip is expanded in
+    """
+    if method == 'opencv':
+        return cv2.pyrUp(np.asarray(A,dtype=dtype),dstsize=(shape[1],shape[0]))
+    return fastLaplPyr3D(A,a_,dtype=dtype,shape=shape)
+
+
+def reduceRows(src,r0,r1,method='scratch',a_=0.4,dtype=np.float32):
+    """
+    Function that computes rows [r0,r1) of the REDUCE of an image, reading only
+    the rows of the source they depend on plus a halo
+    src: array-like image, indexed by rows
+    r0, r1: first and one past the last row of the reduced image
+    method, a_, dtype: see reduceStrip
+    returns: rows [r0,r1) of the reduced image
+    """
+    return reduceRegion(src,(r0,r1),(0,(src.shape[1]+1)//2),lambda A: reduceStrip(A,method,a_,dtype))
+
+
+def expandRows(src,x0,x1,shape,method='scratch',a_=0.4,dtype=np.float32):
+    """
+    Function that computes rows [x0,x1) of the EXPAND of an image, reading only
+    the rows of the source they depend on plus a halo
+    src: array-like image, indexed by rows
+    x0, x1: first and one past the last row of the expanded image
+    shape: shape of the whole expanded image
+    method, a_, dtype: see expandStrip
+    returns: rows [x0,x1) of the expanded image
+    """
+    return expandRegion(src,(x0,x1),(0,shape[1]),shape,lambda A,shape_: expandStrip(A,shape_,method,a_,dtype))
+
+
+def tiledGaussPyramid(src,size,prefix,method='scratch',a_=0.4,strip_rows=256,dtype=np.float32):
+    """
+    Function that generates a Gaussian pyramid strip by strip
+    src: image, as accepted by openImage
+    size: number of times the image is reduced
+    prefix: levels are written to the files prefix + '_gauss_0k.npy'
+    method, a_: see reduceStrip
+    strip_rows: number of rows of the reduced level computed at a time
+    dtype: data type of the levels written to file
+    returns: list with the original image and the memory-mapped levels 1,...,size
+    """
+    gaussPy = [openImage(src)]
+    for k in range(1,size+1):
+        prev_ = gaussPy[-1]
+        shape_ = ((prev_.shape[0]+1)//2,(prev_.shape[1]+1)//2) + prev_.shape[2:]
+        level_ = createLevel('%s_gauss_0%d.npy' % (prefix,k),shape_,dtype)
+        for r0 in range(0,shape_[0],strip_rows):
+            r1 = min(r0+strip_rows,shape_[0])
+            level_[r0:r1] = reduceRows(prev_,r0,r1,method,a_,dtype)
+        level_.flush()
+        gaussPy.append(level_)
+    return gaussPy
+
+
+def tiledLaplacePyramid(src,size,prefix,method='scratch',a_=0.4,strip_rows=256,dtype=np.float32):
+    """
+    Function that generates a Laplacian pyramid strip by strip
+    src: image, as accepted by openImage
+    size: number of Laplacian levels
+    prefix: levels are written to the files prefix + '_laplace_0k.npy'
+    method, a_, strip_rows, dtype: see tiledGaussPyramid
+    returns: list [G_size, L_size-1, ..., L_0] of memory-mapped levels, as Pyramid.laplacePyramid
+    NOTE. Each Gaussian level k+1 and Laplacian level k are written in a single sweep over
+    Gaussian level k (see laplace_pyramid.fusedLaplaceLevel), which is read only once
+    """
+    prev_ = openImage(src)
+    Lapl = []
+    for k in range(size):
+        shape_ = ((prev_.shape[0]+1)//2,(prev_.shape[1]+1)//2) + prev_.shape[2:]
+        gauss_ = createLevel('%s_gauss_0%d.npy' % (prefix,k+1),shape_,dtype)
+        level_ = createLevel('%s_laplace_0%d.npy' % (prefix,k),prev_.shape,dtype)
+        fusedLaplaceLevel(prev_,lambda A: reduceStrip(A,method,a_,dtype),lambda A,s: expandStrip(A,s,method,a_,dtype),
+                          strip_rows=strip_rows,gauss=gauss_,laplace=level_,level=k)
+        gauss_.flush(); level_.flush()
+        Lapl.append(level_)
+        prev_ = gauss_
+    return [prev_] + Lapl[::-1]
+
+
+def tiledBlend(srcA,srcB,name_blend,size,method='scratch',a_=0.4,strip_rows=256,workdir=None,dtype=np.float32):
+    """
+    This function blends two images strip by strip; the left half of the first image is
+    sewed to the right half of the second one. Each level k of the blend is collapsed as
+    R_k = EXPAND(R_k+1) + sew(G_k - EXPAND(G_k+1)), so the Laplacian levels are never stored
+    srcA, srcB: images, as accepted by openImage, with the same shape
+    name_blend: name of the memory-mapped .npy file where the uint8 blend is written
+    size: number of levels of the pyramids
+    method, a_, strip_rows, dtype: see tiledGaussPyramid
+    workdir: directory for the intermediate levels; if None a temporary one is created
+             and removed, with every intermediate level, when the blend is done
+    returns: memory-mapped blended image
+    NOTE. The blend is computed in floating point, without the saturating uint8 operations
+    of from_openCV.blendImages
+    """
+    own_ = workdir is None
+    if own_:
+        workdir = tempfile.mkdtemp(prefix='tiled_blend_')
+    try:
+        gaussA = tiledGaussPyramid(srcA,size,os.path.join(workdir,'A'),method,a_,strip_rows,dtype)
+        gaussB = tiledGaussPyramid(srcB,size,os.path.join(workdir,'B'),method,a_,strip_rows,dtype)
+        if size == 0:
+            # A blend of depth zero just sews both images, written straight to name_blend
+            shape_ = gaussA[0].shape
+            blend_ = createLevel(name_blend,shape_,np.uint8)
+            for x0 in range(0,shape_[0],strip_rows):
+                x1 = min(x0+strip_rows,shape_[0])
+                strip_ = stitchHalves(np.asarray(gaussA[0][x0:x1],dtype=dtype),np.asarray(gaussB[0][x0:x1],dtype=dtype))
+                blend_[x0:x1] = np.clip(np.rint(strip_),0,255)
+            blend_.flush()
+            return blend_
+        # The deepest level of the blend just sews both Gaussian levels
+        blend_ = createLevel(os.path.join(workdir,'blend_0%d.npy' % size),gaussA[size].shape,dtype)
+        blend_[:] = stitchHalves(np.asarray(gaussA[size]),np.asarray(gaussB[size]))
+        for k in range(size-1,-1,-1):
+            shape_ = gaussA[k].shape
+            if k == 0:
+                level_ = createLevel(name_blend,shape_,np.uint8)
+            else:
+                level_ = createLevel(os.path.join(workdir,'blend_0%d.npy' % k),shape_,dtype)
+            for x0 in range(0,shape_[0],strip_rows):
+                x1 = min(x0+strip_rows,shape_[0])
+                lA = np.asarray(gaussA[k][x0:x1],dtype=dtype) - expandRows(gaussA[k+1],x0,x1,shape_,method,a_,dtype)
+                lB = np.asarray(gaussB[k][x0:x1],dtype=dtype) - expandRows(gaussB[k+1],x0,x1,shape_,method,a_,dtype)
+                strip_ = expandRows(blend_,x0,x1,shape_,method,a_,dtype) + stitchHalves(lA,lB)
+                level_[x0:x1] = np.clip(np.rint(strip_),0,255) if k == 0 else strip_
+            level_.flush()
+            blend_ = level_
+    finally:
+        if own_:
+            # The intermediate levels are no longer needed; the blend is in name_blend
+            shutil.rmtree(workdir,ignore_errors=True)
+    return blend_
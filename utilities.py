@@ -1,4 +1,10 @@
 import math as mt
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from profiling import stage
 
 """
 This module contains various functions that support basic operations within 
@@ -11,6 +17,8 @@ def incrDim(n):
     Function that determines the size of extended vector resutlting from convoluting it with kernel w
     n: length of vector
     return: new extended length
+    NOTE. Only right for n = 2^N or 2^N + 1; pass the shape of the level above to
+    laplace_pyramid.fastLaplPyr3D or LaplPyr3D instead of relying on this guess
     """
     n_ = int(mt.floor(mt.log(n,2)))
     return 2**(n_+1) if n%2 == 0 else (2**(n_+1)) + 1
@@ -22,4 +30,222 @@ def redDim(n):
     return: new reduced length
     """
     n_ = int(mt.floor(mt.log(n,2)))
-    return 2**(n_-1) if n%2 == 0 else (2**(n_-1)) + 1
\ No newline at end of file
+    return 2**(n_-1) if n%2 == 0 else (2**(n_-1)) + 1
+
+
+def kernelVector(a_):
+    """
+    Function that builds the five-tap generating kernel used by REDUCE and EXPAND
+    a_: parameter that uniquely defines the kernel
+    return: kernel as a numpy array [0.25-a_/2, 0.25, a_, 0.25, 0.25-a_/2]
+    """
+    return np.array([0.25 - (a_/2.),0.25,a_,0.25,0.25-(a_/2.)])
+
+
+def checkFloatType(dtype):
+    """
+    Function that checks that a data type can hold the levels computed by REDUCE and EXPAND
+    dtype: data type
+    NOTE. Raises ValueError for integer types: the kernel would be cast to them and become zero
+    """
+    if not np.issubdtype(dtype,np.floating):
+        raise ValueError("dtype must be a floating point type, got %s" % (np.dtype(dtype),))
+
+
+def readImage(image):
+    """
+    Function that gives the matrix of an image, reading it only when a file name is given
+    image: name of file containing image, or the image itself, which is returned as is
+           (no copy), so decoded images can be passed around without touching the disk
+    returns: matrix representation of the image
+    """
+    if not isinstance(image,str):
+        return image
+    with stage('decode'):
+        img = cv2.imread(image)
+    if img is None:
+        raise IOError("could not read image %r" % (image,))
+    return img
+
+
+def reduceWindow(n,r0,r1):
+    """
+    Function that gives the samples a REDUCE needs to compute entries [r0,r1) along an axis
+    n: length of the axis before reducing
+    r0, r1: first and one past the last entry of the reduced axis
+    returns: (lo,hi), first and one past the last sample to read
+    """
+    # Entry i of the reduced axis depends on samples 2i-2,...,2i+2. The window starts
+    # at an even sample so both axes stay aligned, and goes one sample further so the
+    # entries kept are never at the (artificial) edges of the window
+    return max(2*r0-2,0),min(2*r1+1,n)
+
+
+def expandWindow(n,x0,x1,length):
+    """
+    Function that gives the samples an EXPAND needs to compute entries [x0,x1) along an axis
+    n: length of the axis before expanding
+    x0, x1: first and one past the last entry of the expanded axis
+    length: length of the whole expanded axis
+    returns: (lo,hi,len_); samples [lo,hi) are read and expanded to length len_
+    """
+    # Entry x of the expanded axis depends on samples x//2-1,...,x//2+1. As in
+    # reduceWindow, the window starts at an even sample and has one extra sample of halo
+    lo = max(x0//2-1,0); lo -= lo%2
+    hi = min((x1-1)//2+3,n)
+    return lo,hi,length-2*lo if hi == n else 2*(hi-lo)
+
+
+def reduceRegion(src,rows,cols,reduce_):
+    """
+    Function that computes a rectangle of the REDUCE of an image, reading only the part
+    of the source it depends on plus a halo
+    src: array-like image
+    rows, cols: (first, one past the last) row and column of the rectangle in the reduced image
+    reduce_: function that reduces a whole image, e.g. pyramid.Pyramid.reduceLevel
+    returns: rectangle of the reduced image
+    """
+    (r0,r1),(c0,c1) = rows,cols
+    lo,hi = reduceWindow(src.shape[0],r0,r1)
+    clo,chi = reduceWindow(src.shape[1],c0,c1)
+    reduced_ = reduce_(np.asarray(src[lo:hi,clo:chi]))
+    return reduced_[r0-lo//2:r1-lo//2,c0-clo//2:c1-clo//2]
+
+
+def expandRegion(src,rows,cols,shape,expand_):
+    """
+    Function that computes a rectangle of the EXPAND of an image, reading only the part
+    of the source it depends on plus a halo
+    src: array-like image
+    rows, cols: (first, one past the last) row and column of the rectangle in the expanded image
+    shape: shape of the whole expanded image
+    expand_: function that expands a whole image to a shape, e.g. pyramid.Pyramid.expandLevel
+    returns: rectangle of the expanded image
+    """
+    (x0,x1),(y0,y1) = rows,cols
+    lo,hi,rows_ = expandWindow(src.shape[0],x0,x1,shape[0])
+    clo,chi,cols_ = expandWindow(src.shape[1],y0,y1,shape[1])
+    expanded_ = expand_(np.asarray(src[lo:hi,clo:chi]),(rows_,cols_))
+    return expanded_[x0-2*lo:x1-2*lo,y0-2*clo:y1-2*clo]
+
+class KernelCache(object):
+    """
+    Least-recently-used cache of the weight tables of REDUCE and EXPAND. Tables are
+    keyed by (mode, kernel, length, ...) and shared by every level, channel and call,
+    so a batch or a video of same-size frames builds them only once. Cached tables
+    are made read-only since they are shared
+    """
+
+    def __init__(self,maxsize=256):
+        """
+        maxsize: maximum number of tables kept; the least recently used is evicted
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self,key,build):
+        """
+        Function that returns the table stored under key, building it if needed
+        key: hashable key of the table
+        build: function without arguments that builds the table (an array or tuple of arrays)
+        returns: cached table
+        """
+        with self._lock:
+            if key in self._tables:
+                self.hits += 1
+                table = self._tables.pop(key)
+                self._tables[key] = table
+                return table
+            self.misses += 1
+        # Build outside of the lock; two threads may build the same table, which is harmless
+        table = build()
+        for array_ in (table if isinstance(table,tuple) else (table,)):
+            array_.setflags(write=False)
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+        return table
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._tables)
+
+
+# Cache shared by the vectorized REDUCE and EXPAND functions
+KERNEL_CACHE = KernelCache()
+
+
+def cachedKernel(a_,dtype=np.float64):
+    """
+    Function that returns the kernel of kernelVector(a_), cached and cast to dtype
+    a_: parameter that uniquely defines the kernel
+    dtype: floating point type of the kernel
+    """
+    return KERNEL_CACHE.get(('kernel',float(a_),np.dtype(dtype).str),
+                            lambda: kernelVector(a_).astype(dtype))
+
+
+# Number of threads used by the vectorized REDUCE and EXPAND when no worker
+# count is given; see setNumWorkers
+_numWorkers = 1
+# Thread pools, one per worker count, created when first needed
+_pools = {}
+_poolsLock = threading.Lock()
+# Arrays with fewer elements than this are never split, threads would only add overhead
+MIN_PARALLEL_SIZE = 1 << 16
+
+
+def setNumWorkers(workers):
+    """
+    Function that sets the number of threads used by default by the vectorized
+    REDUCE and EXPAND (gauss_pyramid.reduceAxis, laplace_pyramid.expandAxis and
+    the functions built on them). NumPy releases the GIL inside its loops, so
+    strips of an image are computed in parallel
+    workers: number of threads; 1 (the default) runs everything in the calling thread
+    """
+    global _numWorkers
+    if workers < 1:
+        raise ValueError("the number of workers must be at least 1, got %r" % (workers,))
+    _numWorkers = int(workers)
+
+
+def getNumWorkers():
+    return _numWorkers
+
+
+def parallelStrips(func,n,workers=None,size=None):
+    """
+    Function that splits the range [0,n) into contiguous strips and calls func(lo,hi)
+    for each one, in a thread pool. func must write its results itself, e.g. into a
+    slice of a preallocated array
+    func: function of the first and one past the last index of a strip
+    n: length of the range
+    workers: number of threads; None uses the one given to setNumWorkers
+    size: number of elements of the array being processed; arrays smaller than
+          MIN_PARALLEL_SIZE are processed in the calling thread
+    """
+    workers = workers or _numWorkers
+    if size is not None and size < MIN_PARALLEL_SIZE:
+        workers = 1
+    workers = min(workers,n)
+    if workers <= 1:
+        func(0,n)
+        return
+    with _poolsLock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers)
+        pool_ = _pools[workers]
+    bounds_ = [n*i//workers for i in range(workers+1)]
+    futures_ = [pool_.submit(func,lo,hi) for lo,hi in zip(bounds_[:-1],bounds_[1:])]
+    # result() re-raises in this thread any exception of a strip
+    for future_ in futures_:
+        future_.result()
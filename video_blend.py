@@ -0,0 +1,191 @@
+from __future__ import print_function
+import argparse
+import sys
+import cv2
+import numpy as np
+from gauss_pyramid import fastGaussPyr3D
+from laplace_pyramid import fastLaplPyr3D
+from from_openCV import readMask
+
+"""
+This module blends two video streams frame by frame. All the levels of the
+pyramids are allocated once, with the first frame, and every following frame
+is reduced, expanded, blended and collapsed into the same buffers; the pyramid
+of the (static) mask is built only once. It is executed with
+`python video_blend.py left.mp4 right.mp4 blend.mp4 --levels 4`
+"""
+
+
+def readFrames(source):
+    """
+    Function that iterates over the frames of a video
+    source: name of a video file, a cv2.VideoCapture, or any iterable of frames
+    returns: generator of frames. Frames of a cv2.VideoCapture are decoded into the
+             same buffer, so a frame must be used (or copied) before asking for the next
+    """
+    if isinstance(source,str):
+        name_ = source
+        source = cv2.VideoCapture(name_)
+        if not source.isOpened():
+            raise IOError("could not open video %r" % (name_,))
+    if not hasattr(source,'read'):
+        for frame_ in source:
+            yield frame_
+        return
+    frame_ = None
+    while True:
+        ok_,frame_ = source.read(frame_)
+        if not ok_:
+            return
+        yield frame_
+
+
+class StreamBlender(object):
+    """
+    Blender of pairs of frames of the same shape with persistent, preallocated buffers.
+    Each level k of the output is M_k*LA_k + (1-M_k)*LB_k, where M_k is the kth level of
+    the Gaussian pyramid of the mask; without a mask the left half of the first frame is
+    sewed to the right half of the second one. Levels are float32, as in
+    from_openCV.blendPyramidsMask with precision 'float32'
+    """
+
+    def __init__(self,shape,size,mask=None,method='opencv',a_=0.4):
+        """
+        shape: shape of the frames
+        size: size of pyramids (number of levels in pyramids) used to do the blending
+        mask: optional soft mask with the weights of the first frame, see from_openCV.readMask
+        method: 'opencv' for cv2.pyrDown/cv2.pyrUp, which write straight into the buffers,
+                or 'scratch' for the vectorized from-scratch functions, whose results are
+                copied into them
+        a_: parameter that determines kernel; only used by the from-scratch method
+        """
+        if method not in ('scratch','opencv'):
+            raise ValueError("method must be 'scratch' or 'opencv', got %r" % (method,))
+        self.shape = tuple(shape)
+        self.size = size
+        self.method = method
+        self.a_ = a_
+        # Shapes of the levels, finest first
+        shapes_ = [self.shape]
+        for k in range(size):
+            shapes_.append(((shapes_[-1][0]+1)//2,(shapes_[-1][1]+1)//2) + self.shape[2:])
+        # Gaussian levels of both frames; the Laplacian level k of each frame is written
+        # over the EXPAND of its Gaussian level k+1, and the blend is accumulated in place
+        # in the Laplacian levels of the first frame
+        self._gaussA = [np.empty(s,dtype=np.float32) for s in shapes_]
+        self._gaussB = [np.empty(s,dtype=np.float32) for s in shapes_]
+        self._laplA = [np.empty(s,dtype=np.float32) for s in shapes_[:-1]]
+        self._laplB = [np.empty(s,dtype=np.float32) for s in shapes_[:-1]]
+        self._out = np.empty(self.shape,dtype=np.uint8)
+        # Gaussian pyramid of the mask, shaped to broadcast over the BGR channels
+        self._mask = None
+        if mask is not None:
+            level_ = readMask(mask,self.shape)
+            self._mask = []
+            for k in range(size+1):
+                self._mask.append(level_[:,:,None] if len(self.shape) == 3 else level_)
+                if k < size:
+                    level_ = self._reduce(level_,np.empty(shapes_[k+1][:2],dtype=np.float32))
+
+    def _reduce(self,src,dst):
+        if self.method == 'opencv':
+            return cv2.pyrDown(src,dst=dst,dstsize=(dst.shape[1],dst.shape[0]))
+        dst[...] = fastGaussPyr3D(src,self.a_,np.float32)
+        return dst
+
+    def _expand(self,src,dst):
+        if self.method == 'opencv':
+            return cv2.pyrUp(src,dst=dst,dstsize=(dst.shape[1],dst.shape[0]))
+        dst[...] = fastLaplPyr3D(src,self.a_,dtype=np.float32,shape=dst.shape)
+        return dst
+
+    def _blendLevel(self,la,lb,k):
+        # Blend level k of both pyramids in place into la
+        if self._mask is None:
+            col_ = la.shape[1]//2
+            la[:,col_:] = lb[:,col_:]
+        else:
+            np.subtract(la,lb,out=la)
+            np.multiply(la,self._mask[k],out=la)
+            np.add(la,lb,out=la)
+
+    def blend(self,frameA,frameB):
+        """
+        Function that blends a pair of frames
+        frameA, frameB: frames of the shape given to the blender
+        returns: uint8 blended frame. It is always the same buffer, overwritten by the
+                 next call, so it must be used (or copied) before blending the next pair
+        """
+        if frameA.shape != self.shape or frameB.shape != self.shape:
+            raise ValueError("frames have shapes %s and %s but the blender expects %s"
+                             % (frameA.shape,frameB.shape,self.shape))
+        gA,gB,lA,lB = self._gaussA,self._gaussB,self._laplA,self._laplB
+        np.copyto(gA[0],frameA,casting='unsafe'); np.copyto(gB[0],frameB,casting='unsafe')
+        for k in range(self.size):
+            self._reduce(gA[k],gA[k+1]); self._reduce(gB[k],gB[k+1])
+        # Laplacian levels, L_k = G_k - EXPAND(G_k+1)
+        for k in range(self.size):
+            np.subtract(gA[k],self._expand(gA[k+1],lA[k]),out=lA[k])
+            np.subtract(gB[k],self._expand(gB[k+1],lB[k]),out=lB[k])
+        # Blend the deepest Gaussian level and collapse, deepest first. The Laplacian
+        # levels of the second frame are no longer needed once blended, so they hold
+        # the EXPAND of the partial result
+        ls_ = gA[self.size]
+        self._blendLevel(ls_,gB[self.size],self.size)
+        for k in range(self.size-1,-1,-1):
+            self._blendLevel(lA[k],lB[k],k)
+            np.add(lA[k],self._expand(ls_,lB[k]),out=lA[k])
+            ls_ = lA[k]
+        # Round and clip to uint8 in place
+        np.rint(ls_,out=ls_)
+        np.clip(ls_,0,255,out=ls_)
+        np.copyto(self._out,ls_,casting='unsafe')
+        return self._out
+
+
+def blendStreams(framesA,framesB,size,mask=None,method='opencv',a_=0.4):
+    """
+    This function blends two streams of frames pair by pair, until either one ends
+    framesA, framesB: video file names, cv2.VideoCapture objects or iterables of frames
+    size, mask, method, a_: see StreamBlender
+    returns: generator of uint8 blended frames. The blender is created with the first pair
+             and every frame yielded is the same buffer, overwritten by the next one
+    """
+    blender_ = None
+    for frameA,frameB in zip(readFrames(framesA),readFrames(framesB)):
+        if blender_ is None:
+            blender_ = StreamBlender(frameA.shape,size,mask,method,a_)
+        yield blender_.blend(frameA,frameB)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Blend two videos frame by frame')
+    parser.add_argument('left',help='video whose left half (or masked part) is kept')
+    parser.add_argument('right',help='video blended with the first one')
+    parser.add_argument('output',help='blended video')
+    parser.add_argument('--levels',type=int,default=4)
+    parser.add_argument('--mask',default=None,help='grayscale image with the weights of the left video')
+    parser.add_argument('--method',choices=('opencv','scratch'),default='opencv')
+    parser.add_argument('--a',dest='a_',type=float,default=0.4,help='kernel parameter of the from-scratch path')
+    parser.add_argument('--fourcc',default='mp4v',help='codec of the output video')
+    args = parser.parse_args(argv)
+
+    captureA = cv2.VideoCapture(args.left)
+    if not captureA.isOpened():
+        raise IOError("could not open video %r" % (args.left,))
+    fps_ = captureA.get(cv2.CAP_PROP_FPS) or 25.
+    writer_ = None; count_ = 0
+    for frame_ in blendStreams(captureA,args.right,args.levels,args.mask,args.method,args.a_):
+        if writer_ is None:
+            writer_ = cv2.VideoWriter(args.output,cv2.VideoWriter_fourcc(*args.fourcc),fps_,
+                                      (frame_.shape[1],frame_.shape[0]))
+        writer_.write(frame_)
+        count_ += 1
+    if writer_ is not None:
+        writer_.release()
+    print('%d frames blended' % count_)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())